@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Pack the frame directories of the videos in one or more split files into .shard files
+(see utils/frame_shards.py) to be used with the --frame_shards_prefix argument of the mfnet scripts.
+
+usage: python -m dataset_preparation.pack_frame_shards shard_prefix split_file [split_file ...]
+
+The shard of e.g. 'frames_rgb_flow\\rgb\\train\\P01\\P01_01' is written to
+'shard_prefix\\rgb\\train\\P01\\P01_01.shard'. Existing shards are skipped.
+"""
+
+import os
+import argparse
+
+from utils.frame_shards import pack_video_frames, shard_path_from_data_path
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Pack video frame directories into shards')
+    parser.add_argument('shard_prefix', type=str)
+    parser.add_argument('split_files', nargs='+', type=str)
+    parser.add_argument('--img_tmpl', type=str, default='frame_{:010d}.jpg')
+    parser.add_argument('--overwrite', default=False, action='store_true')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    video_dirs = set()
+    for split_file in args.split_files:
+        for line in open(split_file):
+            video_dirs.add(line.strip().split(' ')[0])
+
+    for i, video_dir in enumerate(sorted(video_dirs)):
+        shard_path = shard_path_from_data_path(video_dir, args.shard_prefix)
+        if os.path.exists(shard_path) and not args.overwrite:
+            print("{}/{} {} exists, skipping".format(i+1, len(video_dirs), shard_path))
+            continue
+        num_frames = pack_video_frames(os.path.join(*video_dir.split('\\')), shard_path, args.img_tmpl)
+        print("{}/{} {} -> {} ({} frames)".format(i+1, len(video_dirs), video_dir, shard_path, num_frames))
+
+
+if __name__ == '__main__':
+    main()
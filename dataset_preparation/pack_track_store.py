@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Pack the hand track pickles of the samples in one or more split files into a track store
+(see utils/track_store.py) to be used with the --track_store argument of the lstm scripts.
+
+usage: python -m dataset_preparation.pack_track_store store_dir split_file [split_file ...]
+
+With --bpv_prefix the bpv pickles (e.g. noun_bpv_oh) are packed next to the hand tracks for the coords_bpv
+feature and with --objects_prefix the object track pickles for the coords_objects feature.
+"""
+
+import argparse
+
+from utils.dataset_loader import load_pickles
+from utils.track_store import pack_hand_tracks, save_track_store
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Pack hand track pickles into a track store')
+    parser.add_argument('store_dir', type=str)
+    parser.add_argument('split_files', nargs='+', type=str)
+    parser.add_argument('--bpv_prefix', type=str, default=None)
+    parser.add_argument('--objects_prefix', type=str, default=None)
+    parser.add_argument('--num_workers', type=int, default=8)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    assert not (args.bpv_prefix and args.objects_prefix), "A track store holds either the bpv or the object tracks"
+    data_paths = set()
+    for split_file in args.split_files:
+        for line in open(split_file):
+            data_paths.add(line.strip().split(' ')[0])
+    data_paths = sorted(data_paths)
+
+    secondary, secondary_prefix = None, None
+    if args.bpv_prefix:
+        secondary, secondary_prefix = 'bpv', args.bpv_prefix
+    elif args.objects_prefix:
+        secondary, secondary_prefix = 'objects', args.objects_prefix
+    samples = load_pickles(data_paths, secondary_prefix, args.num_workers)
+    arrays = pack_hand_tracks(data_paths, samples, secondary)
+    save_track_store(args.store_dir, arrays)
+    print("{} samples, {} track steps -> {}".format(len(data_paths), len(arrays['tracks']), args.store_dir))
+
+
+if __name__ == '__main__':
+    main()
@@ -19,7 +19,10 @@ import torch.backends.cudnn as cudnn
 
 from models.lstm_hands import LSTM_Hands, LSTM_per_hand, LSTM_Hands_attn
 from utils.dataset_loader import PointDatasetLoader, PointVectorSummedDatasetLoader, PointBpvDatasetLoader, PointObjDatasetLoader
-from utils.dataset_loader_utils import lstm_collate
+from utils.dataset_loader_utils import lstm_collate, packed_lstm_collate, lstm_inputs_to_gpu
+from utils.bucket_sampler import LengthBucketBatchSampler, sample_lengths
+from utils.track_store import TrackStore
+from utils.track_features import TrackFeatureCollate
 from utils.calc_utils import AverageMeter, accuracy, eval_final_print
 from utils.argparse_utils import parse_args
 from utils.file_utils import print_and_save
@@ -37,10 +40,9 @@ def validate_lstm(model, criterion, test_iterator, cur_epoch, dataset, log_file,
     with torch.no_grad():
         model.eval()
         for batch_idx, (inputs, seq_lengths, targets, video_names) in enumerate(test_iterator):
-            inputs = torch.tensor(inputs).cuda()
+            inputs = lstm_inputs_to_gpu(inputs)
             targets = torch.tensor(targets).cuda()
 
-            inputs = inputs.transpose(1,0)
             output = model(inputs, seq_lengths)            
             loss = criterion(output, targets)
             
@@ -70,8 +72,7 @@ def validate_lstm_do(model, criterion, test_iterator, cur_epoch, dataset, log_fi
     with torch.no_grad():
         model.eval()
         for batch_idx, (inputs, seq_lengths, targets, video_names) in enumerate(test_iterator):
-            inputs = torch.tensor(inputs).cuda()
-            inputs = inputs.transpose(1,0)
+            inputs = lstm_inputs_to_gpu(inputs)
             
             output_a, output_b = model(inputs, seq_lengths)
             
@@ -231,6 +232,10 @@ def main():
         
     lstm_model = LSTM_per_hand if args.lstm_dual else LSTM_Hands_attn if args.lstm_attn else LSTM_Hands
     kwargs = {'dropout':0, 'bidir':args.lstm_bidir, 'noun_classes':args.noun_classes, 'double_output':args.double_output}
+    if args.lstm_sparse_bpv:
+        if args.lstm_feature != "coords_bpv" or args.lstm_dual or args.lstm_attn:
+            sys.exit("Sparse bpv inputs require the coords_bpv feature and the LSTM_Hands model.")
+        kwargs['bag_classes'] = 352
     model_ft = lstm_model(args.lstm_input, args.lstm_hidden, args.lstm_layers, args.verb_classes, **kwargs)
     model_ft = torch.nn.DataParallel(model_ft).cuda()
     checkpoint = torch.load(args.ckpt_path)    
@@ -240,6 +245,7 @@ def main():
     if args.only_left and args.only_right:
         sys.exit("It must be at most one of *only_left* or *only_right* True at any time.")
     norm_val = [1., 1., 1., 1.] if args.no_norm_input else [456., 256., 456., 256.]
+    track_store = TrackStore.open(args.track_store) if args.track_store else None
     if args.lstm_feature == "coords" or args.lstm_feature == "coords_dual":
         if args.lstm_clamped and (not args.lstm_dual or args.lstm_seq_size == 0):
             sys.exit("Clamped tracks require dual lstms and a fixed lstm sequence size.")
@@ -247,35 +253,58 @@ def main():
                                             num_classes=args.verb_classes, norm_val=norm_val,
                                             dual=args.lstm_dual, clamp=args.lstm_clamped,
                                             only_left=args.only_left, only_right=args.only_right,
-                                            validation=True)
+                                            validation=True, track_store=track_store,
+                                            preload_workers=args.preload_workers)
     elif args.lstm_feature == "vec_sum" or args.lstm_feature == "vec_sum_dual":
         dataset_loader = PointVectorSummedDatasetLoader(args.val_list,
                                                         max_seq_length=args.lstm_seq_size,
                                                         num_classes=args.verb_classes,
                                                         dual=args.lstm_dual, 
-                                                        validation=True)
+                                                        validation=True, track_store=track_store,
+                                                        preload_workers=args.preload_workers,
+                                                        batch_features=args.batch_track_features)
     elif args.lstm_feature == "coords_bpv":
         dataset_loader = PointBpvDatasetLoader(args.val_list, args.lstm_seq_size,
                                                args.double_output,
                                                norm_val=norm_val,
                                                bpv_prefix=args.bpv_prefix,
-                                               validation=True)
+                                               validation=True, track_store=track_store,
+                                               preload_workers=args.preload_workers,
+                                               sparse_bpv=args.lstm_sparse_bpv)
     elif args.lstm_feature == "coords_objects":
         dataset_loader = PointObjDatasetLoader(args.val_list, args.lstm_seq_size,
                                                args.double_output,
                                                norm_val=norm_val, 
                                                bpv_prefix=args.bpv_prefix,
-                                               validation=True)
+                                               validation=True, track_store=track_store,
+                                               preload_workers=args.preload_workers,
+                                               feature_cache_dir=args.feature_cache_dir)
     else:
         sys.exit("Unsupported lstm feature")
 
     collate_fn = lstm_collate
+    if args.batch_track_features and args.lstm_feature in ["vec_sum", "vec_sum_dual"]:
+        collate_fn = TrackFeatureCollate('vec_sum_dual' if args.lstm_dual else 'vec_sum', max_seq_length=args.lstm_seq_size)
+    if args.lstm_packed:
+        if args.lstm_attn or args.batch_track_features:
+            sys.exit("Packed inputs are not supported by the attention lstm or the batch track features.")
+        collate_fn = packed_lstm_collate
 #    collate_fn = torch.utils.data.dataloader.default_collate
-    dataset_iterator = torch.utils.data.DataLoader(dataset_loader, 
-                                                   batch_size=args.batch_size, 
-                                                   num_workers=args.num_workers, 
-                                                   collate_fn=collate_fn, 
-                                                   pin_memory=True)
+    if args.bucket_batches > 0:
+        batch_sampler = LengthBucketBatchSampler(sample_lengths(dataset_loader), args.batch_size, args.bucket_batches,
+                                                 shuffle=False)
+        print_and_save(batch_sampler, log_file)
+        dataset_iterator = torch.utils.data.DataLoader(dataset_loader,
+                                                       batch_sampler=batch_sampler,
+                                                       num_workers=args.num_workers,
+                                                       collate_fn=collate_fn,
+                                                       pin_memory=True)
+    else:
+        dataset_iterator = torch.utils.data.DataLoader(dataset_loader,
+                                                       batch_size=args.batch_size,
+                                                       num_workers=args.num_workers,
+                                                       collate_fn=collate_fn,
+                                                       pin_memory=True)
     
     ce_loss = torch.nn.CrossEntropyLoss().cuda()
 
@@ -16,6 +16,8 @@ import torch.backends.cudnn as cudnn
 from models.lstm_hands import LSTM_Hands
 from utils.dataset_loader import PointPolarDatasetLoader, AnglesDatasetLoader, PointDiffDatasetLoader
 from utils.dataset_loader_utils import lstm_collate
+from utils.track_store import TrackStore
+from utils.track_features import TrackFeatureCollate
 from utils.calc_utils import AverageMeter, accuracy, analyze_preds_labels
 from utils.argparse_utils import parse_args
 from utils.file_utils import print_and_save
@@ -73,12 +75,16 @@ def main():
     print_and_save("Model loaded to gpu", log_file)
 
     norm_val = [1., 1., 1., 1.] if args.no_norm_input else [456., 256., 456., 256.]
+    track_store = TrackStore.open(args.track_store) if args.track_store else None
 #    dataset_loader = PointPolarDatasetLoader(args.val_list, max_seq_length=args.lstm_seq_size,
 #                                             norm_val=norm_val, validation=True)
     dataset_loader = PointDiffDatasetLoader(args.val_list, max_seq_length=args.lstm_seq_size,
-                                            norm_val=norm_val, validation=True)
+                                            norm_val=norm_val, validation=True, track_store=track_store,
+                                            preload_workers=args.preload_workers,
+                                            batch_features=args.batch_track_features,
+                                            feature_cache_dir=args.feature_cache_dir)
 
-    collate_fn = lstm_collate
+    collate_fn = TrackFeatureCollate('diffs', norm_val) if args.batch_track_features else lstm_collate
 #    collate_fn = torch.utils.data.dataloader.default_collate
     dataset_iterator = torch.utils.data.DataLoader(dataset_loader, 
                                                    batch_size=args.batch_size, 
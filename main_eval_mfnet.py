@@ -18,7 +18,8 @@ from models.mfnet_3d import MFNET_3D
 from models.mfnet_3d_do import MFNET_3D as MFNET_3D_DO
 from utils.argparse_utils import parse_args, make_log_file_name
 from utils.file_utils import print_and_save
-from utils.dataset_loader import VideoDatasetLoader
+from utils.dataset_loader import VideoDatasetLoader, VideoMultiViewDatasetLoader, VideoDenseDatasetLoader
+from utils.frame_cache import SharedFrameCache
 from utils.dataset_loader_utils import Resize, RandomCrop, ToTensorVid, Normalize, CenterCrop
 from utils.calc_utils import AverageMeter, accuracy, eval_final_print
 from utils.video_sampler import RandomSampling, MiddleSampling
@@ -107,6 +108,83 @@ def validate_resnet(model, criterion, test_iterator, cur_epoch, dataset, log_fil
         print_and_save('{} Results: Loss {:.3f}, Top1 {:.3f}, Top5 {:.3f}'.format(dataset, losses.avg, top1.avg, top5.avg), log_file)
     return top1.avg, outputs
 
+def validate_views(model, criterion, test_iterator, num_views, double_output, cur_epoch, dataset, log_file):
+    """Evaluates the (batch x views x C x T x H x W) inputs of VideoMultiViewDatasetLoader in a single pass and returns
+    for every view the (top1, outputs) that validate_resnet(_do) would return for that view alone"""
+    num_outputs = 2 if double_output else 1
+    top1 = [[AverageMeter() for _ in range(num_outputs)] for _ in range(num_views)]
+    outputs = [[[] for _ in range(num_outputs)] for _ in range(num_views)]
+    avg_top1 = [AverageMeter() for _ in range(num_outputs)] # accuracy of the view averaged scores
+    losses = AverageMeter() # of the view averaged scores, weighted as in validate_resnet_do for double_output
+    loss_weights = [0.75, 0.25] if double_output else [1.]
+
+    print_and_save('Evaluating after epoch: {} on {} set with {} views'.format(cur_epoch, dataset, num_views), log_file)
+    with torch.no_grad():
+        model.eval()
+        for batch_idx, (inputs, targets, video_names) in enumerate(test_iterator):
+            batch_size = inputs.size(0)
+            inputs = inputs.view(batch_size * num_views, *inputs.shape[2:]).cuda()
+            task_outputs = model(inputs)
+            if not double_output:
+                task_outputs, targets = (task_outputs,), (targets,)
+            loss = 0
+            for t, (output, target) in enumerate(zip(task_outputs, targets)):
+                output = output.view(batch_size, num_views, -1)
+                loss = loss + loss_weights[t] * criterion(output.mean(1), target.cuda())
+                output = output.detach().cpu()
+                for v in range(num_views):
+                    preds = np.argmax(output[:, v].numpy(), axis=1)
+                    outputs[v][t].extend([[preds[j], target[j].numpy()] for j in range(batch_size)])
+                    top1[v][t].update(accuracy(output[:, v], target, topk=(1,))[0].item(), batch_size)
+                avg_top1[t].update(accuracy(output.mean(1), target, topk=(1,))[0].item(), batch_size)
+            losses.update(loss.item(), batch_size)
+            print_and_save('[Batch {}/{}][View averaged Loss {:.3f}[avg:{:.3f}], Top1 {}]'.format(
+                    batch_idx, len(test_iterator), losses.val, losses.avg,
+                    ', '.join('{:.3f}'.format(t1.avg) for t1 in avg_top1)), log_file)
+        print_and_save('{} Results: View averaged Loss {:.3f}, Top1 {}'.format(
+                dataset, losses.avg, ', '.join('{:.3f}'.format(t1.avg) for t1 in avg_top1)), log_file)
+
+    if not double_output:
+        return [(top1[v][0].avg, outputs[v][0]) for v in range(num_views)]
+    return [((top1[v][0].avg, top1[v][1].avg), (outputs[v][0], outputs[v][1])) for v in range(num_views)]
+
+def validate_dense(model, test_iterator, num_segments, double_output, cur_epoch, dataset, log_file):
+    """Evaluates the (clip, classes, segment) items of VideoDenseDatasetLoader and averages the clip outputs of
+    every segment. Returns the segment level (top1, outputs) that validate_resnet(_do) would return"""
+    num_outputs = 2 if double_output else 1
+    sums, counts = [None] * num_outputs, torch.zeros(num_segments)
+    labels = [torch.zeros(num_segments, dtype=torch.long) for _ in range(num_outputs)]
+
+    print_and_save('Evaluating after epoch: {} on {} set, all the clips of {} segments'.format(
+            cur_epoch, dataset, num_segments), log_file)
+    with torch.no_grad():
+        model.eval()
+        for batch_idx, (inputs, targets, segments) in enumerate(test_iterator):
+            task_outputs = model(inputs.cuda())
+            if not double_output:
+                task_outputs, targets = (task_outputs,), (targets,)
+            for t, (output, target) in enumerate(zip(task_outputs, targets)):
+                output = output.detach().cpu()
+                if sums[t] is None:
+                    sums[t] = torch.zeros(num_segments, output.size(1))
+                sums[t].index_add_(0, segments, output)
+                labels[t][segments] = target
+            counts.index_add_(0, segments, torch.ones(len(segments)))
+            print_and_save('[Batch {}/{}]'.format(batch_idx, len(test_iterator)), log_file)
+
+    assert torch.all(counts > 0), "Segments without clips"
+    top1, outputs = [], []
+    for t in range(num_outputs):
+        segment_outputs = sums[t] / counts.unsqueeze(1)
+        preds = segment_outputs.argmax(1).numpy()
+        top1.append(accuracy(segment_outputs, labels[t], topk=(1,))[0].item())
+        outputs.append([[preds[i], labels[t][i].numpy()] for i in range(num_segments)])
+    print_and_save('{} Results: {} clips, Top1 {}'.format(dataset, int(counts.sum().item()),
+                                                         ', '.join('{:.3f}'.format(t1) for t1 in top1)), log_file)
+    if not double_output:
+        return top1[0], outputs[0]
+    return tuple(top1), tuple(outputs)
+
 def main():
     args = parse_args('mfnet', val=True)
     
@@ -134,7 +212,9 @@ def main():
 
     ce_loss = torch.nn.CrossEntropyLoss().cuda()
 
-    for i in range(args.mfnet_eval):
+    # the frames decoded in the first pass are served from the cache in the next mfnet_eval passes
+    frame_cache = SharedFrameCache(args.frame_cache_mb * 2**20) if args.frame_cache_mb > 0 else None
+    def make_view(i):
         crop_type = CenterCrop((224, 224)) if args.eval_crop == 'center' else RandomCrop((224, 224))
         if args.eval_sampler == 'middle':
             val_sampler = MiddleSampling(num=args.clip_length)
@@ -145,21 +225,70 @@ def main():
 
         val_transforms = transforms.Compose([Resize((256, 256), False), crop_type,
                                              ToTensorVid(), Normalize(mean=mean_3d, std=std_3d)])
+        return val_sampler, val_transforms
+
+    def view_results():
+        # yields the (top1, outputs) of each of the mfnet_eval views
+        if args.dense_eval: # a single result from all the clips of every segment
+            _, val_transforms = make_view(0)
+            val_loader = VideoDenseDatasetLoader(args.val_list, args.clip_length, args.frame_interval,
+                                                 num_classes=num_classes,
+                                                 img_tmpl='frame_{:010d}.jpg',
+                                                 batch_transform=val_transforms,
+                                                 shard_prefix=args.frame_shards_prefix,
+                                                 frame_cache=frame_cache, decode_threads=args.decode_threads,
+                                                 clip_stride=args.dense_clip_stride)
+            val_iter = torch.utils.data.DataLoader(val_loader,
+                                                   batch_size=args.batch_size,
+                                                   shuffle=False,
+                                                   num_workers=args.num_workers,
+                                                   pin_memory=True)
+            yield validate_dense(model_ft, val_iter, val_loader.clip_index.num_segments(), args.double_output,
+                                 checkpoint['epoch'], args.val_list.split("\\")[-1], log_file)
+            return
+
+        if args.single_decode_views: # all the views are made from a single decoding of every segment
+            samplers, view_transforms = zip(*[make_view(i) for i in range(args.mfnet_eval)])
+            val_loader = VideoMultiViewDatasetLoader(list(samplers), args.val_list,
+                                                     num_classes=num_classes,
+                                                     batch_transforms=list(view_transforms),
+                                                     img_tmpl='frame_{:010d}.jpg',
+                                                     validation=True,
+                                                     shard_prefix=args.frame_shards_prefix,
+                                                     frame_cache=frame_cache, decode_threads=args.decode_threads,
+                                                     clip_plan_seed=args.clip_plan_seed)
+            val_iter = torch.utils.data.DataLoader(val_loader,
+                                                   batch_size=args.batch_size,
+                                                   shuffle=False,
+                                                   num_workers=args.num_workers,
+                                                   pin_memory=True)
+            for result in validate_views(model_ft, ce_loss, val_iter, args.mfnet_eval, args.double_output,
+                                         checkpoint['epoch'], args.val_list.split("\\")[-1], log_file):
+                yield result
+            return
 
-        val_loader = VideoDatasetLoader(val_sampler, args.val_list, 
-                                        num_classes=num_classes, 
-                                        batch_transform=val_transforms,
-                                        img_tmpl='frame_{:010d}.jpg',
-                                        validation=True)
-        val_iter = torch.utils.data.DataLoader(val_loader,
-                                               batch_size=args.batch_size,
-                                               shuffle=False,
-                                               num_workers=args.num_workers,
-                                               pin_memory=True)
+        for i in range(args.mfnet_eval):
+            val_sampler, val_transforms = make_view(i)
+            val_loader = VideoDatasetLoader(val_sampler, args.val_list, 
+                                            num_classes=num_classes, 
+                                            batch_transform=val_transforms,
+                                            img_tmpl='frame_{:010d}.jpg',
+                                            validation=True,
+                                            shard_prefix=args.frame_shards_prefix,
+                                            frame_cache=frame_cache, decode_threads=args.decode_threads,
+                                            clip_plan_seed=None if args.clip_plan_seed is None else args.clip_plan_seed + i)
+            val_iter = torch.utils.data.DataLoader(val_loader,
+                                                   batch_size=args.batch_size,
+                                                   shuffle=False,
+                                                   num_workers=args.num_workers,
+                                                   pin_memory=True)
 
-        top1, outputs = validate(model_ft, ce_loss, val_iter, checkpoint['epoch'], args.val_list.split("\\")[-1],
-                                 log_file)
+            yield validate(model_ft, ce_loss, val_iter, checkpoint['epoch'], args.val_list.split("\\")[-1],
+                           log_file)
 
+    num_results = 0
+    for top1, outputs in view_results():
+        num_results += 1
         if not isinstance(top1, tuple):
             video_preds = [x[0] for x in outputs]
             video_labels = [x[1] for x in outputs]
@@ -178,14 +307,16 @@ def main():
             overall_top1 = (overall_top1[0] + top1_acc_a, overall_top1[1] + top1_acc_b)
 
     print_and_save("", log_file)
+    if frame_cache is not None:
+        print_and_save(frame_cache, log_file)
     if not isinstance(top1, tuple):
-        print_and_save("Mean Cls Acc {}".format(overall_mean_cls_acc / args.mfnet_eval), log_file)
-        print_and_save("Dataset Acc ({} times) {}".format(args.mfnet_eval, overall_top1 / args.mfnet_eval), log_file)
+        print_and_save("Mean Cls Acc {}".format(overall_mean_cls_acc / num_results), log_file)
+        print_and_save("Dataset Acc ({} times) {}".format(num_results, overall_top1 / num_results), log_file)
     else:
-        print_and_save("Mean Cls Acc a {}, b {}".format(overall_mean_cls_acc[0] / args.mfnet_eval,
-                                                        overall_mean_cls_acc[1] / args.mfnet_eval), log_file)
-        print_and_save("Dataset Acc ({} times) a {}, b {}".format(args.mfnet_eval, overall_top1[0] / args.mfnet_eval,
-                                                                  overall_top1[1] / args.mfnet_eval), log_file)
+        print_and_save("Mean Cls Acc a {}, b {}".format(overall_mean_cls_acc[0] / num_results,
+                                                        overall_mean_cls_acc[1] / num_results), log_file)
+        print_and_save("Dataset Acc ({} times) a {}, b {}".format(num_results, overall_top1[0] / num_results,
+                                                                  overall_top1[1] / num_results), log_file)
 
 
 if __name__ == '__main__':
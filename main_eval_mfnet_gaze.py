@@ -90,7 +90,7 @@ def main():
                                                   use_gaze=args.use_gaze, gaze_list_prefix=args.gaze_list_prefix,
                                                   use_hands=args.use_hands, hand_list_prefix=args.hand_list_prefix,
                                                   batch_transform=val_transforms, extra_nouns=False, validation=False,
-                                                  gaze_evaluation=True)
+                                                  gaze_evaluation=True, reduced_decode=args.reduced_decode, decode_threads=args.decode_threads)
         val_iter = torch.utils.data.DataLoader(val_loader,
                                                batch_size=args.batch_size,
                                                shuffle=False,
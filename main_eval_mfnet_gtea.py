@@ -75,14 +75,18 @@ def main():
         val_transforms = transforms.Compose([Resize((256, 256), False), crop_type,
                                              ToTensorVid(), Normalize(mean=mean_3d, std=std_3d)])
 
-        # val_loader = FromVideoDatasetLoaderGulp(val_sampler, args.val_list, 'GTEA', num_classes, GTEA_CLASSES,
-        #                                         use_gaze=args.use_gaze, gaze_list_prefix=args.gaze_list_prefix,
-        #                                         use_hands=args.use_hands, hand_list_prefix=args.hand_list_prefix,
-        #                                         batch_transform=val_transforms, extra_nouns=False, validation=True)
-        val_loader = VideoFromImagesDatasetLoader(val_sampler, args.val_list, 'GTEA', num_classes, GTEA_CLASSES,
-                                                  use_gaze=args.use_gaze, gaze_list_prefix=args.gaze_list_prefix,
-                                                  use_hands=args.use_hands, hand_list_prefix=args.hand_list_prefix,
-                                                  batch_transform=val_transforms, extra_nouns=False, validation=True)
+        if args.gulp_data_dir:
+            val_loader = FromVideoDatasetLoaderGulp(val_sampler, args.val_list, 'GTEA', num_classes, GTEA_CLASSES,
+                                                    use_gaze=args.use_gaze, gaze_list_prefix=args.gaze_list_prefix,
+                                                    use_hands=args.use_hands, hand_list_prefix=args.hand_list_prefix,
+                                                    batch_transform=val_transforms, extra_nouns=False, validation=True,
+                                                    gulp_data_dir=args.gulp_data_dir, decode_threads=args.decode_threads)
+        else:
+            val_loader = VideoFromImagesDatasetLoader(val_sampler, args.val_list, 'GTEA', num_classes, GTEA_CLASSES,
+                                                      use_gaze=args.use_gaze, gaze_list_prefix=args.gaze_list_prefix,
+                                                      use_hands=args.use_hands, hand_list_prefix=args.hand_list_prefix,
+                                                      batch_transform=val_transforms, extra_nouns=False, validation=True,
+                                                      reduced_decode=args.reduced_decode, decode_threads=args.decode_threads)
         val_iter = torch.utils.data.DataLoader(val_loader,
                                                batch_size=args.batch_size,
                                                shuffle=False,
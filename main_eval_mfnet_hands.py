@@ -20,6 +20,7 @@ from models.mfnet_3d_mo import MFNET_3D as MFNET_3D_MO
 from utils.argparse_utils import parse_args, make_log_file_name
 from utils.file_utils import print_and_save
 from utils.dataset_loader import VideoAndPointDatasetLoader
+from utils.frame_cache import SharedFrameCache
 from utils.dataset_loader_utils import Resize, RandomCrop, ToTensorVid, Normalize, CenterCrop
 from utils.calc_utils import eval_final_print, eval_final_print_mt
 from utils.video_sampler import RandomSampling, MiddleSampling
@@ -87,6 +88,7 @@ def main():
     valid_classes = [cls for cls in num_classes if cls > 0]
     overall_top1 = [0]*num_valid_classes
     overall_mean_cls_acc = [0]*num_valid_classes
+    frame_cache = SharedFrameCache(args.frame_cache_mb * 2**20) if args.frame_cache_mb > 0 else None
     for i in range(args.mfnet_eval):
         crop_type = CenterCrop((224, 224)) if args.eval_crop == 'center' else RandomCrop((224, 224))
         if args.eval_sampler == 'middle':
@@ -102,7 +104,8 @@ def main():
         val_loader = VideoAndPointDatasetLoader(val_sampler, args.val_list, point_list_prefix=args.bpv_prefix,
                                                 num_classes=num_classes, img_tmpl='frame_{:010d}.jpg',
                                                 norm_val=[456., 256., 456., 256.], batch_transform=val_transforms,
-                                                use_hands=args.use_hands, validation=True)
+                                                use_hands=args.use_hands, validation=True,
+                                                shard_prefix=args.frame_shards_prefix, frame_cache=frame_cache, decode_threads=args.decode_threads)
         val_iter = torch.utils.data.DataLoader(val_loader,
                                                batch_size=args.batch_size,
                                                shuffle=False,
@@ -125,6 +128,8 @@ def main():
             overall_top1[ind] += top1_acc
 
     print_and_save("", log_file)
+    if frame_cache is not None:
+        print_and_save(frame_cache, log_file)
     text_mean_cls_acc = "Mean Cls Acc ({} times)".format(args.mfnet_eval)
     text_dataset_acc = "Dataset Acc ({} times)".format(args.mfnet_eval)
     for ind in range(num_valid_classes):
@@ -14,7 +14,10 @@ import torch.backends.cudnn as cudnn
 from models.lstm_hands import LSTM_Hands, LSTM_per_hand, LSTM_Hands_attn
 #from models.lstm_hands_enc_dec import LSTM_Hands_encdec
 from utils.dataset_loader import PointDatasetLoader, PointVectorSummedDatasetLoader, PointBpvDatasetLoader, PointObjDatasetLoader
-from utils.dataset_loader_utils import lstm_collate
+from utils.dataset_loader_utils import lstm_collate, packed_lstm_collate, WorkerPeakRSS
+from utils.bucket_sampler import LengthBucketBatchSampler, sample_lengths
+from utils.track_store import TrackStore
+from utils.track_features import TrackFeatureCollate
 from utils.argparse_utils import parse_args
 from utils.file_utils import print_and_save, save_checkpoints, resume_checkpoint, init_folders
 from utils.train_utils import load_lr_scheduler, train_lstm, test_lstm, train_attn_lstm, test_attn_lstm, train_lstm_do, test_lstm_do
@@ -29,6 +32,10 @@ def main():
 
     lstm_model = LSTM_per_hand if args.lstm_dual else LSTM_Hands_attn if args.lstm_attn else LSTM_Hands
     kwargs = {'dropout':args.dropout, 'bidir':args.lstm_bidir, 'noun_classes':args.noun_classes, 'double_output':args.double_output}
+    if args.lstm_sparse_bpv:
+        if args.lstm_feature != "coords_bpv" or args.lstm_dual or args.lstm_attn:
+            sys.exit("Sparse bpv inputs require the coords_bpv feature and the LSTM_Hands model.")
+        kwargs['bag_classes'] = 352
     model_ft = lstm_model(args.lstm_input, args.lstm_hidden, args.lstm_layers, args.verb_classes, **kwargs)
 #    model_ft = LSTM_Hands_encdec(456, 64, 32, args.lstm_layers, verb_classes, 0)
     model_ft = torch.nn.DataParallel(model_ft).cuda()
@@ -40,26 +47,37 @@ def main():
     if args.only_left and args.only_right:
         sys.exit("It must be at most one of *only_left* or *only_right* True at any time.")
     norm_val = [1., 1., 1., 1.] if args.no_norm_input else [456., 256., 456., 256.]
+    track_store = TrackStore.open(args.track_store) if args.track_store else None
+    collate_fn = lstm_collate
     if args.lstm_feature == "coords" or args.lstm_feature == "coords_dual":
         if args.lstm_clamped and (not args.lstm_dual or args.lstm_seq_size == 0):
             sys.exit("Clamped tracks require dual lstms and a fixed lstm sequence size.")
         train_loader = PointDatasetLoader(args.train_list, max_seq_length=args.lstm_seq_size,
                                           num_classes=args.verb_classes, norm_val=norm_val,
                                           dual=args.lstm_dual, clamp=args.lstm_clamped,
-                                          only_left=args.only_left, only_right=args.only_right)
+                                          only_left=args.only_left, only_right=args.only_right,
+                                          track_store=track_store, preload_workers=args.preload_workers)
         test_loader = PointDatasetLoader(args.test_list, max_seq_length=args.lstm_seq_size,
                                          num_classes=args.verb_classes, norm_val=norm_val, 
                                          dual=args.lstm_dual, clamp=args.lstm_clamped,
-                                         only_left=args.only_left, only_right=args.only_right)
+                                         only_left=args.only_left, only_right=args.only_right,
+                                         track_store=track_store, preload_workers=args.preload_workers)
     elif args.lstm_feature == "vec_sum" or args.lstm_feature == "vec_sum_dual":
         train_loader = PointVectorSummedDatasetLoader(args.train_list, 
                                                       max_seq_length=args.lstm_seq_size,
                                                       num_classes=args.verb_classes, 
-                                                      dual=args.lstm_dual)
+                                                      dual=args.lstm_dual, track_store=track_store,
+                                                      preload_workers=args.preload_workers,
+                                                      batch_features=args.batch_track_features)
         test_loader = PointVectorSummedDatasetLoader(args.test_list,
                                                      max_seq_length=args.lstm_seq_size,
                                                      num_classes=args.verb_classes,
-                                                     dual=args.lstm_dual)
+                                                     dual=args.lstm_dual, track_store=track_store,
+                                                     preload_workers=args.preload_workers,
+                                                     batch_features=args.batch_track_features)
+        if args.batch_track_features:
+            collate_fn = TrackFeatureCollate('vec_sum_dual' if args.lstm_dual else 'vec_sum',
+                                             max_seq_length=args.lstm_seq_size)
     elif args.lstm_feature == "coords_bpv":
 #        if args.num_workers > 0:
 #            from utils.dataset_loader import make_data_arr, parse_samples_list
@@ -80,25 +98,45 @@ def main():
 #        else:
         train_loader = PointBpvDatasetLoader(args.train_list, args.lstm_seq_size,
                                              args.double_output, norm_val=norm_val,
-                                             bpv_prefix=args.bpv_prefix, num_workers=args.num_workers)
+                                             bpv_prefix=args.bpv_prefix, num_workers=args.num_workers,
+                                             track_store=track_store, preload_workers=args.preload_workers,
+                                             sparse_bpv=args.lstm_sparse_bpv)
         test_loader = PointBpvDatasetLoader(args.test_list, args.lstm_seq_size,
                                             args.double_output, norm_val=norm_val,
-                                            bpv_prefix=args.bpv_prefix, num_workers=args.num_workers)
+                                            bpv_prefix=args.bpv_prefix, num_workers=args.num_workers,
+                                            track_store=track_store, preload_workers=args.preload_workers,
+                                            sparse_bpv=args.lstm_sparse_bpv)
     elif args.lstm_feature == "coords_objects":
         train_loader = PointObjDatasetLoader(args.train_list, args.lstm_seq_size,
                                              args.double_output, norm_val=norm_val,
-                                             bpv_prefix=args.bpv_prefix)
+                                             bpv_prefix=args.bpv_prefix, track_store=track_store,
+                                             preload_workers=args.preload_workers,
+                                             feature_cache_dir=args.feature_cache_dir)
         test_loader = PointObjDatasetLoader(args.test_list, args.lstm_seq_size,
                                             args.double_output, norm_val=norm_val,
-                                            bpv_prefix=args.bpv_prefix)
+                                            bpv_prefix=args.bpv_prefix, track_store=track_store,
+                                            preload_workers=args.preload_workers,
+                                            feature_cache_dir=args.feature_cache_dir)
     
     else:
         sys.exit("Unsupported lstm feature")
 #    train_loader = PointImageDatasetLoader(train_list, norm_val=norm_val)  
 #    test_loader = PointImageDatasetLoader(test_list, norm_val=norm_val)
 
-    train_iterator = torch.utils.data.DataLoader(train_loader, batch_size=args.batch_size, shuffle=True, num_workers=args.num_workers, pin_memory=True, collate_fn=lstm_collate)
-    test_iterator = torch.utils.data.DataLoader(test_loader, batch_size=args.batch_size, shuffle=False, num_workers=args.num_workers, pin_memory=True, collate_fn=lstm_collate)
+    if args.lstm_packed:
+        if args.lstm_attn or args.batch_track_features:
+            sys.exit("Packed inputs are not supported by the attention lstm or the batch track features.")
+        collate_fn = packed_lstm_collate
+    peak_rss = WorkerPeakRSS(args.num_workers, collate_fn)
+    if args.bucket_batches > 0:
+        train_sampler = LengthBucketBatchSampler(sample_lengths(train_loader), args.batch_size, args.bucket_batches)
+        test_sampler = LengthBucketBatchSampler(sample_lengths(test_loader), args.batch_size, args.bucket_batches, shuffle=False)
+        print_and_save("Train: {}\nTest: {}".format(train_sampler, test_sampler), log_file)
+        train_iterator = torch.utils.data.DataLoader(train_loader, batch_sampler=train_sampler, num_workers=args.num_workers, pin_memory=True, collate_fn=peak_rss, worker_init_fn=peak_rss.worker_init_fn)
+        test_iterator = torch.utils.data.DataLoader(test_loader, batch_sampler=test_sampler, num_workers=args.num_workers, pin_memory=True, collate_fn=collate_fn)
+    else:
+        train_iterator = torch.utils.data.DataLoader(train_loader, batch_size=args.batch_size, shuffle=True, num_workers=args.num_workers, pin_memory=True, collate_fn=peak_rss, worker_init_fn=peak_rss.worker_init_fn)
+        test_iterator = torch.utils.data.DataLoader(test_loader, batch_size=args.batch_size, shuffle=False, num_workers=args.num_workers, pin_memory=True, collate_fn=collate_fn)
 
     params_to_update = model_ft.parameters()
     print_and_save("Params to learn:", log_file)
@@ -126,6 +164,8 @@ def main():
             top1 = save_checkpoints(model_ft, optimizer, top1, new_top1,
                                     args.save_all_weights, output_dir, model_name, epoch,
                                     log_file)
+        if args.report_worker_rss:
+            print_and_save(peak_rss, log_file)
                 
 
 if __name__=='__main__':
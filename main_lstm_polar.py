@@ -13,6 +13,8 @@ import torch.backends.cudnn as cudnn
 from models.lstm_hands import LSTM_Hands
 from utils.dataset_loader import PointPolarDatasetLoader, AnglesDatasetLoader, PointDiffDatasetLoader
 from utils.dataset_loader_utils import lstm_collate
+from utils.track_store import TrackStore
+from utils.track_features import TrackFeatureCollate
 from utils.argparse_utils import parse_args
 from utils.file_utils import print_and_save, save_checkpoints, resume_checkpoint, init_folders
 from utils.train_utils import load_lr_scheduler, train_lstm, test_lstm
@@ -35,6 +37,7 @@ def main():
         print_and_save("Resuming training from: {}".format(ckpt_path), log_file)
 
     norm_val = [1., 1., 1., 1.] if args.no_norm_input else [456., 256., 456., 256.]
+    track_store = TrackStore.open(args.track_store) if args.track_store else None
 
 #    train_loader = PointPolarDatasetLoader(args.train_list, max_seq_length=args.lstm_seq_size,
 #                                           norm_val=norm_val)
@@ -44,12 +47,19 @@ def main():
 #    test_loader = AnglesDatasetLoader(args.test_list, max_seq_length=args.lstm_seq_size)
     
     train_loader = PointDiffDatasetLoader(args.train_list, max_seq_length=args.lstm_seq_size, 
-                                          norm_val=norm_val)
+                                          norm_val=norm_val, track_store=track_store,
+                                          preload_workers=args.preload_workers,
+                                          batch_features=args.batch_track_features,
+                                          feature_cache_dir=args.feature_cache_dir)
     test_loader = PointDiffDatasetLoader(args.test_list, max_seq_length=args.lstm_seq_size,
-                                         norm_val=norm_val)
+                                         norm_val=norm_val, track_store=track_store,
+                                         preload_workers=args.preload_workers,
+                                         batch_features=args.batch_track_features,
+                                         feature_cache_dir=args.feature_cache_dir)
+    collate_fn = TrackFeatureCollate('diffs', norm_val) if args.batch_track_features else lstm_collate
 
-    train_iterator = torch.utils.data.DataLoader(train_loader, batch_size=args.batch_size, shuffle=True, num_workers=args.num_workers, collate_fn=lstm_collate, pin_memory=True)
-    test_iterator = torch.utils.data.DataLoader(test_loader, batch_size=args.batch_size, shuffle=False, num_workers=args.num_workers, collate_fn=lstm_collate, pin_memory=True)
+    train_iterator = torch.utils.data.DataLoader(train_loader, batch_size=args.batch_size, shuffle=True, num_workers=args.num_workers, collate_fn=collate_fn, pin_memory=True)
+    test_iterator = torch.utils.data.DataLoader(test_loader, batch_size=args.batch_size, shuffle=False, num_workers=args.num_workers, collate_fn=collate_fn, pin_memory=True)
 
     params_to_update = model_ft.parameters()
     print_and_save("Params to learn:", log_file)
@@ -16,7 +16,9 @@ from models.mfnet_3d_do import MFNET_3D as MFNET_3D_DO
 from utils.argparse_utils import parse_args
 from utils.file_utils import print_and_save, save_checkpoints, init_folders
 from utils.dataset_loader import VideoDatasetLoader, prepare_sampler
-from utils.dataset_loader_utils import RandomScale, RandomCrop, RandomHorizontalFlip, RandomHLS, ToTensorVid, Normalize, Resize, CenterCrop
+from utils.frame_cache import SharedFrameCache
+from utils.dataset_loader_utils import RandomScale, RandomCrop, RandomHorizontalFlip, RandomHLS, ToTensorVid, Normalize, Resize, CenterCrop, WorkerPeakRSS
+from utils.dataset_loader_utils import ToUint8TensorVid, BatchNormalizedLoader
 from utils.train_utils import load_lr_scheduler, CyclicLR, mixup_data, mixup_criterion
 from utils.calc_utils import AverageMeter, accuracy
 
@@ -206,29 +208,41 @@ def main():
     print_and_save("Model loaded on gpu {} devices".format(args.gpus), log_file)
 
     # load dataset and train and validation iterators
+    frame_cache = SharedFrameCache(args.frame_cache_mb * 2**20) if args.frame_cache_mb > 0 else None
     train_sampler = prepare_sampler("train", args.clip_length, args.frame_interval)
+    # with collate_normalize the workers return uint8 clips which are normalized per batch on the gpu
+    to_tensor = [ToUint8TensorVid()] if args.collate_normalize else [ToTensorVid(), Normalize(mean=mean_3d, std=std_3d)]
     train_transforms = transforms.Compose([
             RandomScale(make_square=True, aspect_ratio=[0.8, 1./0.8], slen=[224, 288]),
-            RandomCrop((224, 224)), RandomHorizontalFlip(), RandomHLS(vars=[15, 35, 25]),
-            ToTensorVid(), Normalize(mean=mean_3d, std=std_3d)])
+            RandomCrop((224, 224)), RandomHorizontalFlip(), RandomHLS(vars=[15, 35, 25])] + to_tensor)
     train_loader = VideoDatasetLoader(train_sampler, args.train_list, 
                                       num_classes=num_classes, 
                                       batch_transform=train_transforms,
-                                      img_tmpl='frame_{:010d}.jpg')
+                                      img_tmpl='frame_{:010d}.jpg',
+                                      shard_prefix=args.frame_shards_prefix,
+                                      frame_cache=frame_cache, decode_threads=args.decode_threads,
+                                      clip_plan_seed=args.clip_plan_seed)
+    peak_rss = WorkerPeakRSS(args.num_workers)
     train_iterator = torch.utils.data.DataLoader(train_loader, batch_size=args.batch_size,
                                                  shuffle=True, num_workers=args.num_workers,
-                                                 pin_memory=True)
+                                                 pin_memory=True, collate_fn=peak_rss,
+                                                 worker_init_fn=peak_rss.worker_init_fn)
     
     test_sampler = prepare_sampler("val", args.clip_length, args.frame_interval)
-    test_transforms=transforms.Compose([Resize((256, 256), False), CenterCrop((224, 224)),
-                                        ToTensorVid(), Normalize(mean=mean_3d, std=std_3d)])
+    test_transforms=transforms.Compose([Resize((256, 256), False), CenterCrop((224, 224))] + to_tensor)
     test_loader = VideoDatasetLoader(test_sampler, args.test_list, 
                                      num_classes=num_classes,
                                      batch_transform=test_transforms,
-                                     img_tmpl='frame_{:010d}.jpg')
+                                     img_tmpl='frame_{:010d}.jpg',
+                                     shard_prefix=args.frame_shards_prefix,
+                                     frame_cache=frame_cache, decode_threads=args.decode_threads,
+                                     clip_plan_seed=args.clip_plan_seed)
     test_iterator = torch.utils.data.DataLoader(test_loader, batch_size=args.batch_size,
                                                 shuffle=False, num_workers=args.num_workers,
                                                 pin_memory=True)
+    if args.collate_normalize:
+        train_iterator = BatchNormalizedLoader(train_iterator, mean_3d, std_3d, torch.device('cuda', args.gpus[0]))
+        test_iterator = BatchNormalizedLoader(test_iterator, mean_3d, std_3d, torch.device('cuda', args.gpus[0]))
 
     # config optimizer
     param_base_layers = []
@@ -264,6 +278,7 @@ def main():
     train = train_cnn if not args.double_output else train_cnn_do
     test = test_cnn if not args.double_output else test_cnn_do
     for epoch in range(args.max_epochs):
+        train_loader.set_epoch(epoch)
         train(model_ft, optimizer, ce_loss, train_iterator, args.mixup_a, epoch, log_file, args.gpus, lr_scheduler)
         if (epoch+1) % args.eval_freq == 0:
             if args.eval_on_train:
@@ -272,6 +287,10 @@ def main():
             top1 = save_checkpoints(model_ft, optimizer, top1, new_top1,
                                     args.save_all_weights, output_dir, model_name, epoch,
                                     log_file)
+        if frame_cache is not None:
+            print_and_save(frame_cache, log_file)
+        if args.report_worker_rss:
+            print_and_save(peak_rss, log_file)
             
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -18,7 +18,8 @@ from models.mfnet_3d_mo import MFNET_3D as MFNET_3D_MO
 from utils.argparse_utils import parse_args
 from utils.file_utils import print_and_save, save_mt_checkpoints, init_folders, resume_checkpoint
 from utils.dataset_loader import FromVideoDatasetLoader, FromVideoDatasetLoaderGulp, VideoFromImagesDatasetLoader, prepare_sampler
-from utils.dataset_loader_utils import RandomScale, RandomCrop, RandomHorizontalFlip, RandomHLS, ToTensorVid, Normalize, Resize, CenterCrop
+from utils.dataset_loader_utils import RandomScale, RandomCrop, RandomHorizontalFlip, RandomHLS, ToTensorVid, Normalize, Resize, CenterCrop, WorkerPeakRSS
+from utils.dataset_loader_utils import ToUint8TensorVid, BatchNormalizedLoader
 from utils.train_utils import load_lr_scheduler, train_mfnet_mo, test_mfnet_mo
 
 mean_3d = [124 / 255, 117 / 255, 104 / 255]
@@ -76,36 +77,49 @@ def main():
 
     # load dataset and train and validation iterators
     train_sampler = prepare_sampler("train", args.clip_length, args.frame_interval)
+    # with collate_normalize the workers return uint8 clips which are normalized per batch on the gpu
+    to_tensor = [ToUint8TensorVid()] if args.collate_normalize else [ToTensorVid(), Normalize(mean=mean_3d, std=std_3d)]
     train_transforms = transforms.Compose([
         RandomScale(make_square=True, aspect_ratio=[0.8, 1./0.8], slen=[224, 288]),
-        RandomCrop((224, 224)), RandomHorizontalFlip(), RandomHLS(vars=[15, 35, 25]),
-        ToTensorVid(), Normalize(mean=mean_3d, std=std_3d)])
-    # train_loader = FromVideoDatasetLoaderGulp(train_sampler, args.train_list, 'GTEA', num_classes, GTEA_CLASSES,
-    #                                           use_gaze=args.use_gaze, gaze_list_prefix=args.gaze_list_prefix,
-    #                                           use_hands=args.use_hands, hand_list_prefix=args.hand_list_prefix,
-    #                                           batch_transform=train_transforms, extra_nouns=False)
-    train_loader = VideoFromImagesDatasetLoader(train_sampler, args.train_list, 'GTEA', num_classes, GTEA_CLASSES,
-                                                use_gaze=args.use_gaze, gaze_list_prefix=args.gaze_list_prefix,
-                                                use_hands=args.use_hands, hand_list_prefix=args.hand_list_prefix,
-                                                batch_transform=train_transforms, extra_nouns=False)
+        RandomCrop((224, 224)), RandomHorizontalFlip(), RandomHLS(vars=[15, 35, 25])] + to_tensor)
+    if args.gulp_data_dir:
+        train_loader = FromVideoDatasetLoaderGulp(train_sampler, args.train_list, 'GTEA', num_classes, GTEA_CLASSES,
+                                                  use_gaze=args.use_gaze, gaze_list_prefix=args.gaze_list_prefix,
+                                                  use_hands=args.use_hands, hand_list_prefix=args.hand_list_prefix,
+                                                  batch_transform=train_transforms, extra_nouns=False,
+                                                  gulp_data_dir=args.gulp_data_dir, decode_threads=args.decode_threads)
+    else:
+        train_loader = VideoFromImagesDatasetLoader(train_sampler, args.train_list, 'GTEA', num_classes, GTEA_CLASSES,
+                                                    use_gaze=args.use_gaze, gaze_list_prefix=args.gaze_list_prefix,
+                                                    use_hands=args.use_hands, hand_list_prefix=args.hand_list_prefix,
+                                                    batch_transform=train_transforms, extra_nouns=False,
+                                                    reduced_decode=args.reduced_decode, decode_threads=args.decode_threads)
+    peak_rss = WorkerPeakRSS(args.num_workers)
     train_iterator = torch.utils.data.DataLoader(train_loader, batch_size=args.batch_size,
                                                  shuffle=True, num_workers=args.num_workers,
-                                                 pin_memory=True)
+                                                 pin_memory=True, collate_fn=peak_rss,
+                                                 worker_init_fn=peak_rss.worker_init_fn)
 
     test_sampler = prepare_sampler("val", args.clip_length, args.frame_interval)
-    test_transforms = transforms.Compose([Resize((256, 256), False), CenterCrop((224, 224)),
-                                          ToTensorVid(), Normalize(mean=mean_3d, std=std_3d)])
-    # test_loader = FromVideoDatasetLoaderGulp(test_sampler, args.test_list, 'GTEA', num_classes, GTEA_CLASSES,
-    #                                          use_gaze=args.use_gaze, gaze_list_prefix=args.gaze_list_prefix,
-    #                                          use_hands=args.use_hands, hand_list_prefix=args.hand_list_prefix,
-    #                                          batch_transform=test_transforms, extra_nouns=False)
-    test_loader = VideoFromImagesDatasetLoader(test_sampler, args.test_list, 'GTEA', num_classes, GTEA_CLASSES,
-                                               use_gaze=args.use_gaze, gaze_list_prefix=args.gaze_list_prefix,
-                                               use_hands=args.use_hands, hand_list_prefix=args.hand_list_prefix,
-                                               batch_transform=test_transforms, extra_nouns=False)
+    test_transforms = transforms.Compose([Resize((256, 256), False), CenterCrop((224, 224))] + to_tensor)
+    if args.gulp_data_dir:
+        test_loader = FromVideoDatasetLoaderGulp(test_sampler, args.test_list, 'GTEA', num_classes, GTEA_CLASSES,
+                                                 use_gaze=args.use_gaze, gaze_list_prefix=args.gaze_list_prefix,
+                                                 use_hands=args.use_hands, hand_list_prefix=args.hand_list_prefix,
+                                                 batch_transform=test_transforms, extra_nouns=False,
+                                                 gulp_data_dir=args.gulp_data_dir, decode_threads=args.decode_threads)
+    else:
+        test_loader = VideoFromImagesDatasetLoader(test_sampler, args.test_list, 'GTEA', num_classes, GTEA_CLASSES,
+                                                   use_gaze=args.use_gaze, gaze_list_prefix=args.gaze_list_prefix,
+                                                   use_hands=args.use_hands, hand_list_prefix=args.hand_list_prefix,
+                                                   batch_transform=test_transforms, extra_nouns=False,
+                                                   reduced_decode=args.reduced_decode, decode_threads=args.decode_threads)
     test_iterator = torch.utils.data.DataLoader(test_loader, batch_size=args.batch_size,
                                                 shuffle=False, num_workers=args.num_workers,
                                                 pin_memory=True)
+    if args.collate_normalize:
+        train_iterator = BatchNormalizedLoader(train_iterator, mean_3d, std_3d, torch.device('cuda', args.gpus[0]))
+        test_iterator = BatchNormalizedLoader(test_iterator, mean_3d, std_3d, torch.device('cuda', args.gpus[0]))
 
     # config optimizer
     param_base_layers = []
@@ -151,6 +165,8 @@ def main():
                             "Test", log_file, args.gpus)
             top1 = save_mt_checkpoints(model_ft, optimizer, top1, new_top1, args.save_all_weights, output_dir,
                                        model_name, epoch, log_file)
+        if args.report_worker_rss:
+            print_and_save(peak_rss, log_file)
 
 
 if __name__ == '__main__':
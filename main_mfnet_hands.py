@@ -18,6 +18,7 @@ from models.mfnet_3d_mo import MFNET_3D as MFNET_3D_MO
 from utils.argparse_utils import parse_args
 from utils.file_utils import print_and_save, save_mt_checkpoints, resume_checkpoint, init_folders
 from utils.dataset_loader import VideoAndPointDatasetLoader, prepare_sampler
+from utils.frame_cache import SharedFrameCache
 from utils.dataset_loader_utils import RandomScale, RandomCrop, RandomHorizontalFlip, RandomHLS, ToTensorVid, Normalize, Resize, CenterCrop
 from utils.train_utils import load_lr_scheduler, train_mfnet_mo, test_mfnet_mo
 
@@ -74,6 +75,7 @@ def main():
         model_ft, ckpt_path = resume_checkpoint(model_ft, output_dir, model_name, args.resume_from)
         print_and_save("Resuming training from: {}".format(ckpt_path), log_file)
 
+    frame_cache = SharedFrameCache(args.frame_cache_mb * 2**20) if args.frame_cache_mb > 0 else None
     # load train-val sampler
     train_sampler = prepare_sampler("train", args.clip_length, args.frame_interval)
     train_transforms = transforms.Compose([
@@ -83,7 +85,8 @@ def main():
     train_loader = VideoAndPointDatasetLoader(train_sampler, args.train_list, point_list_prefix=args.bpv_prefix,
                                               num_classes=num_classes, img_tmpl='frame_{:010d}.jpg',
                                               norm_val=[456., 256., 456., 256.], batch_transform=train_transforms,
-                                              use_hands=args.use_hands)
+                                              use_hands=args.use_hands, shard_prefix=args.frame_shards_prefix,
+                                             frame_cache=frame_cache, decode_threads=args.decode_threads)
     train_iterator = torch.utils.data.DataLoader(train_loader, batch_size=args.batch_size,
                                                  shuffle=True, num_workers=args.num_workers,
                                                  pin_memory=True)
@@ -96,7 +99,8 @@ def main():
     test_loader = VideoAndPointDatasetLoader(test_sampler, args.test_list, point_list_prefix=args.bpv_prefix,
                                              num_classes=num_classes, img_tmpl='frame_{:010d}.jpg',
                                              norm_val=[456., 256., 456., 256.], batch_transform=test_transforms,
-                                             use_hands=args.use_hands)
+                                             use_hands=args.use_hands, shard_prefix=args.frame_shards_prefix,
+                                             frame_cache=frame_cache, decode_threads=args.decode_threads)
 
     test_iterator = torch.utils.data.DataLoader(test_loader, batch_size=args.batch_size,
                                                 shuffle=False, num_workers=args.num_workers,
@@ -145,6 +149,8 @@ def main():
                             "Test", log_file, args.gpus)
             top1 = save_mt_checkpoints(model_ft, optimizer, top1, new_top1, args.save_all_weights, output_dir,
                                        model_name, epoch, log_file)
+        if frame_cache is not None:
+            print_and_save(frame_cache, log_file)
 
 
 if __name__ == '__main__':
@@ -11,6 +11,15 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+def unscatter_packed(packed_inputs):
+    # DataParallel moves the batch_sizes of a PackedSequence to the gpu with the data but the lstm needs them on the cpu
+    return nn.utils.rnn.PackedSequence(packed_inputs.data, packed_inputs.batch_sizes.cpu())
+
+def packed_last_steps(batch_sizes, seq_lengths):
+    # the rows of the packed data with the last step of every sequence, sorted descending in sequence size
+    step_offsets = torch.cumsum(batch_sizes, 0) - batch_sizes
+    return step_offsets[seq_lengths.cpu() - 1] + torch.arange(len(seq_lengths))
+
 class LSTM_Hands(nn.Module):
     # source: https://github.com/yunjey/pytorch-tutorial/blob/master/tutorials/02-intermediate/bidirectional_recurrent_neural_network/main.py
     def __init__(self, input_size, hidden_size, num_layers, num_classes, **kwargs):
@@ -21,6 +30,14 @@ class LSTM_Hands(nn.Module):
         self.bidir = kwargs.get('bidir')
         self.noun_classes = kwargs.get('noun_classes')
         self.double_output = kwargs.get('double_output')
+        # sparse bpv: the inputs end with the object ids of each step (-1 padded) instead of the
+        # bag_classes wide bpv, and the bpv part of the input projection is an EmbeddingBag
+        self.bag_classes = kwargs.get('bag_classes', 0)
+        if self.bag_classes > 0:
+            self.coords_size = input_size - self.bag_classes
+            bag_size = kwargs.get('bag_size') or hidden_size
+            self.bag = nn.EmbeddingBag(self.bag_classes, bag_size, mode='sum')
+            input_size = self.coords_size + bag_size
 
         self.lstm = nn.LSTM(input_size, hidden_size, num_layers, 
                             bias=True, batch_first=False, dropout=0.0, bidirectional=self.bidir)
@@ -31,7 +48,23 @@ class LSTM_Hands(nn.Module):
         if self.double_output:
             self.fc2 = nn.Linear(output_features, self.noun_classes)
     
+    def embed_bags(self, seq_batch_coords):
+        # [..., input_size] inputs, e.g. [seq, batch, input_size] or the [steps, input_size] packed data
+        leading_size = seq_batch_coords.size()[:-1]
+        coords = seq_batch_coords[..., :self.coords_size]
+        object_ids = seq_batch_coords[..., self.coords_size:].long()
+        object_ids = object_ids.reshape(-1, object_ids.size(-1))
+        valid = object_ids >= 0
+        bag_lengths = valid.sum(1)
+        offsets = torch.cumsum(bag_lengths, 0) - bag_lengths
+        bags = self.bag(object_ids[valid], offsets).view(*leading_size, -1)
+        return torch.cat((coords, bags), dim=-1)
+
     def forward(self, seq_batch_coords, seq_length):
+        if isinstance(seq_batch_coords, nn.utils.rnn.PackedSequence):
+            return self.forward_packed(unscatter_packed(seq_batch_coords), seq_length)
+        if self.bag_classes > 0:
+            seq_batch_coords = self.embed_bags(seq_batch_coords)
         if self.bidir:
             return self.forward_bidir(seq_batch_coords, seq_length)
         else:
@@ -59,6 +92,33 @@ class LSTM_Hands(nn.Module):
             out = self.fc(out)
             return out
 
+    def forward_packed(self, packed_inputs, seq_lengths):
+        # packed_inputs from packed_lstm_collate, no padding to pack and unpack
+        if self.bag_classes > 0:
+            packed_inputs = nn.utils.rnn.PackedSequence(self.embed_bags(packed_inputs.data), packed_inputs.batch_sizes)
+        batch_size = int(packed_inputs.batch_sizes[0])
+        num_directions = 2 if self.bidir else 1
+        h0 = torch.zeros(self.num_layers*num_directions, batch_size, self.hidden_size).cuda()
+        c0 = torch.zeros(self.num_layers*num_directions, batch_size, self.hidden_size).cuda()
+
+        lstm_out, hidden = self.lstm(packed_inputs, (h0, c0))
+        last_steps = packed_last_steps(packed_inputs.batch_sizes, seq_lengths)
+        if self.bidir: # the backward direction ends at the first step, the first batch_size rows
+            out_for = lstm_out.data[last_steps, :self.hidden_size]
+            out_back = lstm_out.data[:batch_size, self.hidden_size:]
+            out = torch.cat((out_for, out_back), dim=-1)
+        else:
+            out = lstm_out.data[last_steps]
+
+        out = self.dropout(out)
+        if self.double_output:
+            out_verb = self.fc(out)
+            out_noun = self.fc2(out)
+            return out_verb, out_noun
+        else:
+            out = self.fc(out)
+            return out
+
     def forward_onedir(self, seq_batch_coords, seq_lengths):
         # seq_batch_coords is sorted descending in sequence size so we can pad
         batch_size = seq_batch_coords.size(1)
@@ -115,6 +175,8 @@ class LSTM_per_hand(nn.Module):
         self.fc = nn.Linear(2*hidden_size, num_classes)
 
     def forward(self, seq_batch_coords, seq_lengths):
+        if isinstance(seq_batch_coords, nn.utils.rnn.PackedSequence):
+            return self.forward_packed(unscatter_packed(seq_batch_coords), seq_lengths)
         batch_size = seq_batch_coords.size(1)
         # for dual lstm
         h0 = torch.zeros(self.num_layers, batch_size, self.hidden_size).cuda()
@@ -135,6 +197,24 @@ class LSTM_per_hand(nn.Module):
         
         return out
 
+    def forward_packed(self, packed_inputs, seq_lengths):
+        batch_sizes = packed_inputs.batch_sizes
+        batch_size = int(batch_sizes[0])
+        h0 = torch.zeros(self.num_layers, batch_size, self.hidden_size).cuda()
+        c0 = torch.zeros(self.num_layers, batch_size, self.hidden_size).cuda()
+
+        left_packed = nn.utils.rnn.PackedSequence(packed_inputs.data[:, :self.input_size].contiguous(), batch_sizes)
+        right_packed = nn.utils.rnn.PackedSequence(packed_inputs.data[:, self.input_size:].contiguous(), batch_sizes)
+        left_lstm_out, _ = self.left_lstm(left_packed, (h0, c0))
+        right_lstm_out, _ = self.right_lstm(right_packed, (h0, c0))
+
+        last_steps = packed_last_steps(batch_sizes, seq_lengths)
+        out = torch.cat((left_lstm_out.data[last_steps], right_lstm_out.data[last_steps]), dim=-1)
+
+        out = self.fc(out)
+
+        return out
+
 class EncoderLSTM(nn.Module):
     def __init__(self, input_size, hidden_size, num_layers):
         super(EncoderLSTM, self).__init__()
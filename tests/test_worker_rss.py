@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Memory of the dataloader workers of the lstm scripts
+
+The preloaded hand tracks are kept in flat numpy buffers (see utils/track_store.py), so a forked worker
+reads them without copying the pages of the main process. The private dirty memory of every worker should
+then not grow over an epoch nor with the number of workers. linux only (fork and /proc/self/smaps_rollup).
+
+usage: python -m unittest tests.test_worker_rss
+"""
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+
+from utils.dataset_loader import PointDatasetLoader
+from utils.dataset_loader_utils import WorkerPeakRSS, lstm_collate, get_private_dirty_kb
+
+NUM_SAMPLES = 3000
+TRACK_LENGTH = 300
+BATCH_SIZE = 32
+SLACK_KB = 16 * 1024 # the batches, the imports of the workers and the allocator
+
+
+def make_hand_tracks(data_dir, num_samples, track_length, seed=0):
+    """Writes hand track pickles with lists of points, as the real ones, and a split file of them"""
+    rng = np.random.RandomState(seed)
+    split_file = os.path.join(data_dir, 'split.txt')
+    with open(split_file, 'w') as split:
+        for i in range(num_samples):
+            tracks = {'left': rng.uniform(0, 456, (track_length, 2)).tolist(),
+                      'right': rng.uniform(0, 456, (track_length, 2)).tolist()}
+            track_path = os.path.join(data_dir, '{}.pkl'.format(i))
+            with open(track_path, 'wb') as f:
+                pickle.dump(tracks, f)
+            split.write("{} {} {} {}\n".format(track_path, track_length, i % 10, i % 20))
+    return split_file
+
+
+def private_peaks(dataset, num_workers, num_batches=None):
+    """Peak private dirty KB of every worker (of the main process for num_workers 0) over num_batches
+    batches, or over the whole epoch"""
+    peak_rss = WorkerPeakRSS(num_workers, lstm_collate)
+    if num_batches is not None:
+        dataset = torch.utils.data.Subset(dataset, range(num_batches * BATCH_SIZE))
+    loader = torch.utils.data.DataLoader(dataset, batch_size=BATCH_SIZE, num_workers=num_workers,
+                                         collate_fn=peak_rss, worker_init_fn=peak_rss.worker_init_fn,
+                                         multiprocessing_context='fork' if num_workers > 0 else None)
+    for _ in loader:
+        pass
+    return np.array(peak_rss.private_peaks[:max(num_workers, 1)])
+
+
+@unittest.skipUnless(hasattr(os, 'fork') and get_private_dirty_kb() is not None, "needs fork and smaps_rollup")
+class WorkerRSSTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.data_dir = tempfile.mkdtemp()
+        split_file = make_hand_tracks(cls.data_dir, NUM_SAMPLES, TRACK_LENGTH)
+        cls.dataset = PointDatasetLoader(split_file, TRACK_LENGTH, norm_val=[456., 256., 456., 256.])
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.data_dir)
+
+    def test_flat_over_epoch(self):
+        for num_workers in [0, 2, 4]:
+            first_batches = private_peaks(self.dataset, num_workers, num_batches=2 * max(num_workers, 1))
+            epoch = private_peaks(self.dataset, num_workers)
+            print("{} workers, private dirty KB after the first batches {}, after the epoch {}".format(
+                num_workers, first_batches.tolist(), epoch.tolist()))
+            self.assertLess(epoch.max() - first_batches.max(), SLACK_KB)
+
+    def test_flat_with_num_workers(self):
+        peaks = {num_workers: private_peaks(self.dataset, num_workers) for num_workers in [2, 4]}
+        print("private dirty KB of the workers: {}".format({k: v.tolist() for k, v in peaks.items()}))
+        self.assertLess(peaks[4].max() - peaks[2].max(), SLACK_KB)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -38,6 +38,9 @@ def parse_args_dataset(parser, net_type):
     parser.add_argument('--verb_classes', type=int, default=120) # max epic:125, gtea:19
     parser.add_argument('--noun_classes', type=int, default=0) # max epic:322, gtea:53
     parser.add_argument('--batch_size', type=int, default=1)
+    if net_type in ['mfnet', 'lstm']:
+        parser.add_argument('--report_worker_rss', default=False, action='store_true',
+                            help="print the peak resident memory of every train dataloader worker after each epoch.")
     if net_type in ['resnet', 'mfnet']:
         parser.add_argument('--clip_gradient', action='store_true')
     if net_type == 'resnet':
@@ -49,6 +52,20 @@ def parse_args_dataset(parser, net_type):
     if net_type == 'mfnet':
         parser.add_argument('--clip_length', type=int, default=16, help="define the length of each input sample.")
         parser.add_argument('--frame_interval', type=int, default=2, help="define the sampling interval between frames.")
+        parser.add_argument('--frame_shards_prefix', type=str, default=None,
+                            help="read the epic frames from the packed .shard files under this prefix (see dataset_preparation/pack_frame_shards.py) instead of the frame directories.")
+        parser.add_argument('--frame_cache_mb', type=int, default=0,
+                            help="if > 0, size of the shared memory cache of decoded frames that is used by all the dataloader workers.")
+        parser.add_argument('--reduced_decode', default=False, action='store_true',
+                            help="decode the gtea jpegs at 1/2, 1/4 or 1/8 scale when the first transform downscales them anyway (only if the decoded frames are still at least its input size, the frames are never upscaled). No effect on the 640x480 gtea frames with the Resize 256 and RandomScale transforms of the mfnet scripts, whose 1/2 decode is too small for them.")
+        parser.add_argument('--decode_threads', type=int, default=0,
+                            help="if > 1, number of threads in every dataloader worker that decode the frames of a clip concurrently.")
+        parser.add_argument('--collate_normalize', default=False, action='store_true',
+                            help="the workers return uint8 clips and the scaling/normalization is done once per batch on the gpu.")
+        parser.add_argument('--clip_plan_seed', type=int, default=None,
+                            help="draw the clips of all the epic segments at once every epoch with this seed, instead of in each dataloader worker (main_mfnet and main_eval_mfnet).")
+        parser.add_argument('--gulp_data_dir', type=str, default=None,
+                            help="read the gtea frames from this gulp directory instead of the frame directories.")
         #parser.add_argument('--img_tmpl', type=str)
     if net_type in ['lstm', 'lstm_polar', 'lstm_diffs']:
         parser.add_argument('--lstm_feature', default='coords',
@@ -63,7 +80,17 @@ def parse_args_dataset(parser, net_type):
                             + "coords_diffs: 8 for coords+diffs," \
                             + "vec_sum/vec_sum_dual: 712 (i.e. 256+456)")
         parser.add_argument('--no_norm_input', default=False, action='store_true', help='will not normalize input to 0-1')
+        parser.add_argument('--track_store', type=str, default=None,
+                            help="read the hand tracks from this directory made with dataset_preparation/pack_track_store.py instead of the pickles.")
+        parser.add_argument('--preload_workers', type=int, default=0,
+                            help="number of processes that load the hand track pickles before training.")
+        parser.add_argument('--feature_cache_dir', type=str, default=None,
+                            help="keep the diffs/polar input features (with a fixed lstm_seq_size) or the float16 object tracks of each split file in this directory and reuse them in the next runs.")
+        parser.add_argument('--batch_track_features', default=False, action='store_true',
+                            help="compute the diffs/polar/vec_sum features for the whole padded batch in the collate function instead of per sample.")
     if net_type == 'lstm':
+        parser.add_argument('--bucket_batches', type=int, default=0,
+                            help="if not 0, batch samples of similar sequence length together, in buckets of this many batches. Mostly useful with lstm_seq_size 0.")
         parser.add_argument('--lstm_clamped', default=False, action='store_true', 
                             help='will remove the non existing hand points in a sequence and result in each hand having a starting sequence of different length. Sampling from these sequences is possible afterwards. Works only for dual lstm and coords feature.')
     
@@ -92,6 +119,10 @@ def parse_args_network(parser, net_type):
     if net_type == 'lstm':
         parser.add_argument('--lstm_dual', default=False, action='store_true')
         parser.add_argument('--lstm_attn', default=False, action='store_true')
+        parser.add_argument('--lstm_packed', default=False, action='store_true',
+                            help="collate the inputs into a PackedSequence in the loader workers instead of padding them. Not for the attention lstm.")
+        parser.add_argument('--lstm_sparse_bpv', default=False, action='store_true',
+                            help="coords_bpv only: feed the object ids of each step to an EmbeddingBag instead of the dense 352 bpv. lstm_input stays 356.")
         parser.add_argument('--only_left', default=False, action='store_true')
         parser.add_argument('--only_right', default=False, action='store_true')
         
@@ -128,6 +159,12 @@ def parse_args_eval(parser):
     # Parameters for evaluation during testing
     # mfnet
     parser.add_argument('--mfnet_eval', type=int, default=1)
+    parser.add_argument('--single_decode_views', default=False, action='store_true',
+                        help="make the mfnet_eval views of every segment from a single decoding and evaluate them in one pass.")
+    parser.add_argument('--dense_eval', default=False, action='store_true',
+                        help="evaluate every clip of every segment in one pass and average the clip outputs of each segment, instead of the mfnet_eval views.")
+    parser.add_argument('--dense_clip_stride', type=int, default=None,
+                        help="frames between the starts of consecutive dense_eval clips, by default the clip length (clip_length x frame_interval) so that they do not overlap.")
     parser.add_argument('--eval_sampler', type=str, default='random', choices=['middle', 'random', 'doublefull'])
     parser.add_argument('--eval_crop', type=str, default='random', choices=['center', 'random'])
     parser.add_argument('--old_mfnet_eval', default=False, action='store_true')
@@ -206,6 +243,8 @@ def make_model_name(args, net_type):
             model_name = model_name + "_dual"
         if args.lstm_attn:
             model_name = model_name + "_attn"
+        if args.lstm_sparse_bpv:
+            model_name = model_name + "_sparse"
         if args.lstm_clamped:
             model_name = model_name + "_clamped"
         if args.no_norm_input:
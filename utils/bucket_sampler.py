@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Length bucketed batches for the full length (lstm_seq_size 0) hand track sequences
+
+lstm_collate pads every batch to its longest sequence, so with random batches of segments that last from a few
+to thousands of frames most of the lstm inputs are padding. LengthBucketBatchSampler sorts the samples by length
+into buckets of bucket_batches batches each. Every epoch the samples are shuffled within each bucket (equal
+lengths are also shuffled across the bucket borders) before being cut into batches, and the batches of all the
+buckets are shuffled together. Use as DataLoader(dataset, batch_sampler=sampler, ...) without batch_size and
+shuffle.
+"""
+
+import numpy as np
+
+
+def sample_lengths(dataset):
+    """Sequence length of every sample of a point dataset loader, from its track index without loading
+    the samples. With a fixed max_seq_length all the samples have that length, unless the features are
+    made after the padding (batch_features) from the full tracks"""
+    if dataset.max_seq_length and not getattr(dataset, 'batch_features', False):
+        return np.full(len(dataset), dataset.max_seq_length, dtype=np.int64)
+    return dataset.data_arr.lengths()
+
+
+def padding_ratio(lengths, batches):
+    # fraction of the padded [batch_size, max_seq_size] inputs that is padding
+    padded = sum(len(batch) * lengths[batch].max() for batch in batches)
+    return 1. - sum(lengths[batch].sum() for batch in batches) / max(padded, 1)
+
+
+class LengthBucketBatchSampler(object):
+    """Batches of sample indices of similar sequence lengths.
+    lengths: the sequence length of every sample, e.g. sample_lengths(dataset)
+    bucket_batches: number of batches in a bucket, the larger the less padding and the less random the batches
+    shuffle: False keeps the batches in ascending length order, e.g. for evaluation
+    """
+    def __init__(self, lengths, batch_size, bucket_batches=50, shuffle=True, drop_last=False, seed=0):
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.batch_size = batch_size
+        self.bucket_size = batch_size * max(bucket_batches, 1)
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.rng = np.random.RandomState(seed)
+        self.last_batches = None
+
+    def make_batches(self):
+        if self.shuffle: # a random order before the stable sort shuffles the samples of equal length
+            order = self.rng.permutation(len(self.lengths))
+            order = order[np.argsort(self.lengths[order], kind='stable')]
+        else:
+            order = np.argsort(self.lengths, kind='stable')
+        batches = []
+        for start in range(0, len(order), self.bucket_size):
+            bucket = order[start:start + self.bucket_size]
+            if self.shuffle:
+                bucket = bucket[self.rng.permutation(len(bucket))]
+            for batch_start in range(0, len(bucket), self.batch_size):
+                batches.append(bucket[batch_start:batch_start + self.batch_size])
+        if self.drop_last:
+            batches = [batch for batch in batches if len(batch) == self.batch_size]
+        if self.shuffle:
+            batches = [batches[i] for i in self.rng.permutation(len(batches))]
+        return batches
+
+    def __iter__(self):
+        self.last_batches = self.make_batches()
+        for batch in self.last_batches:
+            yield batch.tolist()
+
+    def __len__(self):
+        # every bucket but the last is a whole number of batches
+        num_samples = len(self.lengths)
+        last_bucket = num_samples % self.bucket_size
+        full_batches = (num_samples - last_bucket) // self.batch_size + last_bucket // self.batch_size
+        if self.drop_last or last_bucket % self.batch_size == 0:
+            return full_batches
+        return full_batches + 1
+
+    def padding_ratio(self):
+        """Padding of the last epoch's batches (or of a new set of batches before the first epoch)
+        and of random batches of the same size, for comparison"""
+        batches = self.last_batches if self.last_batches is not None else self.make_batches()
+        random_order = np.random.RandomState(0).permutation(len(self.lengths))
+        random_batches = [random_order[i:i + self.batch_size] for i in range(0, len(random_order), self.batch_size)]
+        return padding_ratio(self.lengths, batches), padding_ratio(self.lengths, random_batches)
+
+    def __repr__(self):
+        bucketed, random = self.padding_ratio()
+        return "Length bucketed batches: {} batches, padding {:.1%} of the inputs (random batches {:.1%})".format(
+            len(self), bucketed, random)
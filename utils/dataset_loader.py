@@ -9,13 +9,24 @@ Image dataset loader for a .txt file with a sample per line in the format
 """
 
 import os
+import time
 import pickle
+import multiprocessing as mp
 
 import cv2
 import numpy as np
-from scipy.spatial.distance import pdist, squareform
+import torch
 from torch.utils.data import Dataset as torchDataset
-from utils.video_sampler import RandomSampling, SequentialSampling, MiddleSampling, DoubleFullSampling, FullSampling
+from utils.video_sampler import RandomSampling, SequentialSampling, MiddleSampling, DoubleFullSampling, FullSampling, EpochClipPlanner, \
+    DenseClipIndex
+from utils.dataset_loader_utils import get_decode_size_hint
+from utils.frame_shards import FrameShardReader, GulpFrameReader, REDUCED_DECODE_FLAGS
+from utils.decode_pool import map_frames
+from utils.frame_index import build_frame_index
+from utils.track_store import TrackStore, pack_hand_tracks, compact_objects, load_compact_objects
+from utils.track_raster import TrailRasterizer
+from utils.feature_cache import feature_cache_path, load_feature_cache, build_feature_cache
+from utils.path_index import SamplePathIndex
 
 
 def get_class_weights(list_file, num_classes, use_mapping):
@@ -65,36 +76,85 @@ def load_pickle(tracks_path):
     return tracks
 
 
-def substitute_prefix(tracks_path, secondary_prefix):
-    obj_path = secondary_prefix
-    for p in tracks_path.split('\\')[1:]:
-        obj_path = os.path.join(obj_path, p)
-    return obj_path
+def load_pickle_pair(paths):
+    return load_pickle(paths[0]), load_pickle(paths[1])
+
+
+def load_pickles(tracks_paths, secondary_prefix=None, num_workers=0, chunksize=64, report_every=5000, path_index=None):
+    ''' yields the contents of the pickles in order, or the (tracks, secondary) tuples with a secondary_prefix.
+    the sample paths are resolved with path_index, a SamplePathIndex of the paths and the secondary_prefix that is
+    built here if not given. with num_workers > 0 the pickles are loaded in a process pool, chunksize pickles per task.
+    all the paths are checked before loading, so that a missing pickle fails at once and not midway '''
+    if path_index is None:
+        path_index = SamplePathIndex(tracks_paths, secondary_prefix)
+    assert path_index.secondary_prefix == secondary_prefix, "The path index is for another secondary prefix"
+    path_index.check()
+    resolved_paths = [path_index.paths(tracks_path) for tracks_path in tracks_paths]
+
+    load_fn = load_pickle_pair if secondary_prefix else load_pickle
+    pool = mp.Pool(num_workers) if num_workers > 0 else None
+    try:
+        samples = pool.imap(load_fn, resolved_paths, chunksize) if pool is not None else map(load_fn, resolved_paths)
+        t0 = time.time()
+        for i, sample in enumerate(samples):
+            if (i + 1) % report_every == 0 or i + 1 == len(tracks_paths):
+                elapsed = time.time() - t0
+                print("Loaded {}/{} pickles, {:.1f} pickles/s".format(i + 1, len(tracks_paths),
+                                                                      (i + 1) / max(elapsed, 1e-6)))
+            yield sample
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
+def load_point_samples(samples_list, bpv_prefix=None, track_store=None, secondary='bpv', num_workers=0):
+    ''' secondary is 'bpv' or 'objects', the kind of the pickles at bpv_prefix.
+    num_workers processes load the pickles when there is no track_store '''
+    if track_store is None:
+        # pack the pickles into flat numpy arrays in memory (see utils/track_store.py) instead of keeping a list
+        # of dicts of lists, whose refcounts are touched by every access and get copied into each forked worker
+        data_paths = sorted(set(sample.data_path for sample in samples_list))
+        samples = load_pickles(data_paths, bpv_prefix, num_workers)
+        track_store = TrackStore(pack_hand_tracks(data_paths, samples, secondary if bpv_prefix else None))
+    return track_store.samples(samples_list, with_secondary=bool(bpv_prefix))
+
+
+def get_reduce_factor(frame_size, decode_size):
+    ''' largest jpeg scale denominator that keeps the decoded (w, h) frame_size at least as large as decode_size '''
+    if decode_size is None:
+        return 1
+    w, h = frame_size
+    min_w, min_h = decode_size
+    for factor in [8, 4, 2]:
+        if -(-w // factor) >= min_w and -(-h // factor) >= min_h: # jpeg reduced decode rounds up
+            return factor
+    return 1
 
-def load_two_pickle(tracks_path, secondary_prefix):
-    obj_path = substitute_prefix(tracks_path, secondary_prefix)
-    return load_pickle(tracks_path), load_pickle(obj_path)
-
-
-def load_point_samples(samples_list, bpv_prefix=None):
-    if bpv_prefix:
-        data_arr = [load_two_pickle(samples_list[index].data_path, bpv_prefix) for index in range(len(samples_list))]
-    else:
-        data_arr = [load_pickle(samples_list[index].data_path) for index in range(len(samples_list))]
-    return data_arr
 
 # from PIL import Image
-def load_images(data_path, frame_indices, image_tmpl):
-    images = []
+def load_images(data_path, frame_indices, image_tmpl, reduce_factor=1, num_threads=0):
     # images = np.zeros((len(frame_indices), 640, 480, 3))
-    for f_ind in frame_indices:
+    def load_image(f_ind):
         im_name = os.path.join(data_path, image_tmpl.format(f_ind))
         # next_image = np.array(Image.open(im_name).convert('RGB'))
-        next_image = cv2.imread(im_name, cv2.IMREAD_COLOR)
-        next_image = cv2.cvtColor(next_image, cv2.COLOR_BGR2RGB)
-        images.append(next_image)
-        # images[i] = next_image
-    return images
+        next_image = cv2.imread(im_name, REDUCED_DECODE_FLAGS[reduce_factor])
+        return cv2.cvtColor(next_image, cv2.COLOR_BGR2RGB)
+    # with num_threads > 1 the frames of the clip are decoded concurrently by the thread pool of this worker
+    return map_frames(load_image, frame_indices, num_threads)
+
+
+def load_clip_frames(data_path, frame_indices, image_tmpl, shard_reader=None, frame_cache=None, reduce_factor=1,
+                     num_threads=0):
+    # loads from the frame directory or from the packed shard, and through the shared frame cache if there is one
+    def load_fn(indices):
+        if shard_reader is not None:
+            return shard_reader.load_images(data_path, indices, reduce_factor, num_threads)
+        return load_images(data_path, indices, image_tmpl, reduce_factor, num_threads)
+
+    if frame_cache is None:
+        return load_fn(frame_indices)
+    cache_path = data_path if reduce_factor == 1 else "{}@{}".format(data_path, reduce_factor)
+    return frame_cache.load_images(cache_path, frame_indices, load_fn)
 
 
 def prepare_sampler(sampler_type, clip_length, frame_interval):
@@ -112,21 +172,31 @@ def prepare_sampler(sampler_type, clip_length, frame_interval):
     return out_sampler
 
 
-def object_list_to_bpv(detections, num_noun_classes, max_seq_length):
-    sampled_detections = np.array(detections)
+def sample_object_lists(detections, max_seq_length):
     if max_seq_length != 0:
-        sampled_detections = sampled_detections[
-            np.linspace(0, len(detections), max_seq_length, endpoint=False, dtype=int)].tolist()
-        seq_length = max_seq_length
-    else:
-        seq_length = len(detections)
-    bpv = np.zeros((seq_length, num_noun_classes), dtype=np.float32)
-    for i, dets in enumerate(sampled_detections):
-        for obj in dets:
-            bpv[i, obj] = 1
+        return [detections[i] for i in np.linspace(0, len(detections), max_seq_length, endpoint=False, dtype=int)]
+    return detections
+
+
+def object_list_to_bpv(detections, num_noun_classes, max_seq_length):
+    sampled_detections = sample_object_lists(detections, max_seq_length)
+    bpv = np.zeros((len(sampled_detections), num_noun_classes), dtype=np.float32)
+    steps = np.repeat(np.arange(len(sampled_detections)), [len(dets) for dets in sampled_detections])
+    bpv[steps, [obj for dets in sampled_detections for obj in dets]] = 1
     return bpv
 
 
+def object_list_to_ids(detections, max_objects, max_seq_length):
+    ''' sparse alternative of object_list_to_bpv: the object ids of every step padded with -1 to max_objects,
+    which the bag_classes input of LSTM_Hands turns into an EmbeddingBag '''
+    sampled_detections = sample_object_lists(detections, max_seq_length)
+    ids = np.full((len(sampled_detections), max_objects), -1, dtype=np.float32)
+    for i, dets in enumerate(sampled_detections):
+        dets = np.unique(dets) # the bpv is binary, an object detected twice in a step is summed once in the bag
+        ids[i, :len(dets)] = dets
+    return ids
+
+
 def load_left_right_tracks(hand_tracks, max_seq_length):
     left_track = np.array(hand_tracks['left'], dtype=np.float32)
     right_track = np.array(hand_tracks['right'], dtype=np.float32)
@@ -159,9 +229,23 @@ def calc_angles(track):
     return angles
 
 
+def calc_vec_sum(left_track, right_track, dual=False):
+    ''' row i counts the x and y values (456 + 256 columns, twice with dual for the right hand) of the points of
+    steps 0..i that are inside the 256 high frame. the counts of each step are scattered and summed over time '''
+    feat_size = 456 + 256
+    feat_addon = feat_size if dual else 0
+    vec = np.zeros((len(left_track), feat_size * 2 if dual else feat_size), dtype=np.float32)
+    for track, addon in ((left_track, 0), (right_track, feat_addon)):
+        steps = np.flatnonzero(track[:, 1] < 256)
+        np.add.at(vec, (steps, addon + track[steps, 0]), 1)
+        np.add.at(vec, (steps, addon + 456 + track[steps, 1]), 1)
+    return np.cumsum(vec, axis=0, out=vec)
+
+
 def calc_polar_distance_from_prev(track):
-    return np.concatenate((np.array([0]),
-                           np.diagonal(squareform(pdist(track)), offset=-1)))
+    # the first off diagonal of squareform(pdist(track)), without making the N x N matrix
+    steps = np.diff(track.astype(np.float64), axis=0)
+    return np.concatenate((np.array([0]), np.sqrt(np.sum(steps * steps, axis=1))))
 
 
 class DataLine(object):
@@ -268,7 +352,8 @@ class ImageDatasetLoader(torchDataset):
         return len(self.samples_list)
 
     def __getitem__(self, index):
-        img = cv2.imread(self.samples_list[index].data_path, self.image_read_type).astype(np.float32)
+        # kept in uint8 through the transforms, To01Range converts to float32 at the end
+        img = cv2.imread(self.samples_list[index].data_path, self.image_read_type)
         if self.channels == 'RGB':
             img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
 
@@ -290,8 +375,15 @@ class ImageDatasetLoader(torchDataset):
 class Video(object):
     # adapted from https://github.com/cypw/PyTorch-MFNet/blob/master/data/video_iterator.py
     """basic Video class"""
-
-    def __init__(self, vid_path):
+    # gaps up to this many frames are skipped with grab() instead of a seek, since a seek has to decode
+    # from the previous keyframe anyway
+    MAX_GRAB_GAP = 16
+
+    def __init__(self, vid_path, max_grab_gap=MAX_GRAB_GAP):
+        self.max_grab_gap = max_grab_gap
+        self.decoded_frames = 0 # frames read and converted, i.e. returned
+        self.skipped_frames = 0 # frames grabbed but not decoded to skip small gaps
+        self.seeks = 0
         self.open(vid_path)
 
     def __del__(self):
@@ -308,6 +400,7 @@ class Video(object):
         self.vid_path = None
         self.frame_count = -1
         self.faulty_frame = None
+        self.next_pos = None # index of the frame the next read() returns, None if unknown
         return self
 
     def open(self, vid_path):
@@ -321,6 +414,7 @@ class Video(object):
         if cap.isOpened():
             self.cap = cap
             self.vid_path = vid_path
+            self.next_pos = 0
         else:
             raise IOError("VideoIter:: failed to open video: `{}'".format(vid_path))
 
@@ -340,6 +434,7 @@ class Video(object):
                     break
                 verified_frame_count = i + 1
             self.frame_count = verified_frame_count
+            self.next_pos = None
         else:
             self.frame_count = unverified_frame_count
         assert self.frame_count > 0, "VideoIter:: Video: `{}' has no frames".format(self.vid_path)
@@ -352,23 +447,45 @@ class Video(object):
             frames = self.extract_frames_slow(idxs, force_color)
         return frames
 
+    def plan_reads(self, idxs):
+        """Returns the (frame index, seek, num frames to grab before the read) steps that read the sorted unique idxs,
+        seeking only when the gap from the current position is negative or larger than max_grab_gap"""
+        plan = []
+        pos = self.next_pos
+        for idx in sorted(set(idxs)):
+            gap = idx - pos if pos is not None else -1
+            if 0 <= gap <= self.max_grab_gap:
+                plan.append((idx, False, gap))
+            else:
+                plan.append((idx, True, 0))
+            pos = idx + 1
+        return plan
+
     def extract_frames_fast(self, idxs, force_color=True):
         assert self.cap is not None, "No opened video."
         if len(idxs) < 1:
             return []
+        assert (self.frame_count < 0) or (max(idxs) < self.frame_count), \
+            "idxs: {} > total valid frames({})".format(idxs, self.frame_count)
 
-        frames = []
-        pre_idx = max(idxs)
-        for idx in idxs:
-            assert (self.frame_count < 0) or (idx < self.frame_count), \
-                "idxs: {} > total valid frames({})".format(idxs, self.frame_count)
-            if pre_idx != (idx - 1):
+        decoded = {}
+        for idx, seek, num_grabs in self.plan_reads(idxs):
+            if seek:
                 self.cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+                self.seeks += 1
+            for _ in range(num_grabs): # skip the frames in between without decoding them
+                if not self.cap.grab():
+                    self.faulty_frame = idx
+                    self.next_pos = None
+                    return None
+            self.skipped_frames += num_grabs
             res, frame = self.cap.read() # in BGR/GRAY format
-            pre_idx = idx
             if not res:
                 self.faulty_frame = idx
+                self.next_pos = None
                 return None
+            self.next_pos = idx + 1
+            self.decoded_frames += 1
             if len(frame.shape) < 3:
                 if force_color:
                     # Convert Gray to RGB
@@ -376,8 +493,8 @@ class Video(object):
             else:
                 # Convert BGR to RGB
                 frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            frames.append(frame)
-        return frames
+            decoded[idx] = frame
+        return [decoded[idx] for idx in idxs]
 
     def extract_frames_slow(self, idxs, force_color=True):
         assert self.cap is not None, "No opened video."
@@ -387,6 +504,7 @@ class Video(object):
         frames = [None] * len(idxs)
         idx = min(idxs)
         self.cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+        self.next_pos = None
         while idx <= max(idxs):
             res, frame = self.cap.read() # in BGR/GRAY format
             if not res:
@@ -418,9 +536,14 @@ class VideoFromImagesDatasetLoader(torchDataset): # loads GTEA dataset from fram
     OBJECTIVE_NAMES = ['label_action', 'label_verb', 'label_noun']
     def __init__(self, sampler, split_file, line_type, num_classes, max_num_classes, img_tmpl='img_{:05d}.jpg',
                  batch_transform=None, extra_nouns=False, use_gaze=False, gaze_list_prefix=None, use_hands=False,
-                 hand_list_prefix=None, validation=False, gaze_evaluation=False, vis_data=False):
+                 hand_list_prefix=None, validation=False, gaze_evaluation=False, vis_data=False, reduced_decode=False,
+                 decode_threads=0, index_workers=8):
         self.sampler = sampler
         self.video_list = parse_samples_list(split_file, GTEADataLine)  # if line_type=='GTEA' else DataLine)
+        # resolve the frame directories and count their frames once, instead of a listdir in every __getitem__
+        self.frame_paths = [video.frames_path for video in self.video_list]
+        frame_index = build_frame_index(split_file, self.frame_paths, index_workers)
+        self.frame_counts = [frame_index[path] for path in self.frame_paths]
         self.extra_nouns = extra_nouns
         self.usable_objectives = list()
         self.mappings = list()
@@ -441,22 +564,38 @@ class VideoFromImagesDatasetLoader(torchDataset): # loads GTEA dataset from fram
         self.norm_val = [640., 480., 640., 480.]
         self.image_tmpl = img_tmpl
         self.gaze_evaluation = gaze_evaluation
+        # decode the jpegs directly at 1/2, 1/4 or 1/8 scale when the first transform resizes them down anyway
+        self.decode_size = get_decode_size_hint(batch_transform) if reduced_decode else None
+        self.frame_size = None # (w, h) of the full size frames, found on the first decoded frame
+        self.decode_threads = decode_threads
 
     def __len__(self):
         return len(self.video_list)
 
+    def get_reduce_factor(self, path, sampled_idxs):
+        if self.decode_size is None:
+            return 1
+        if self.frame_size is None:
+            frame_h, frame_w, _ = load_images(path, sampled_idxs[:1], self.image_tmpl)[0].shape
+            self.frame_size = (frame_w, frame_h)
+        return get_reduce_factor(self.frame_size, self.decode_size)
+
     def __getitem__(self, index):
-        path = self.video_list[index].frames_path
+        path = self.frame_paths[index]
         instance_name = self.video_list[index].instance_name
-        frame_count = len(os.listdir(path))
+        frame_count = self.frame_counts[index]
         assert frame_count > 0
 
         sampled_idxs = self.sampler.sampling(range_max=frame_count, v_id=index, start_frame=0)
 
-        sampled_frames = load_images(path, sampled_idxs, self.image_tmpl)
+        reduce_factor = self.get_reduce_factor(path, sampled_idxs)
+        sampled_frames = load_images(path, sampled_idxs, self.image_tmpl, reduce_factor, self.decode_threads)
 
         clip_input = np.concatenate(sampled_frames, axis=2)
-        or_h, or_w, _ = clip_input.shape
+        if reduce_factor > 1: # the tracks are in full frame coordinates, so scale them from the full frame size
+            or_w, or_h = self.frame_size
+        else:
+            or_h, or_w, _ = clip_input.shape
 
         # gaze points is the final output, gaze data is the pickle data, gaze track is intermediate versions
         gaze_points, gaze_data, gaze_track = None, None, None
@@ -626,7 +765,7 @@ class FromVideoDatasetLoaderGulp(torchDataset): #loads GTEA dataset from gulp
     OBJECTIVE_NAMES = ['label_action', 'label_verb', 'label_noun']
     def __init__(self, sampler, split_file, line_type, num_classes, max_num_classes, batch_transform=None,
                  extra_nouns=False, use_gaze=False, gaze_list_prefix=None, use_hands=False, hand_list_prefix=None,
-                 validation=False, vis_data=False):
+                 validation=False, vis_data=False, gulp_data_dir=None, decode_threads=0):
         self.sampler = sampler
         self.video_list = parse_samples_list(split_file, GTEADataLine)  # if line_type=='GTEA' else DataLine)
         self.extra_nouns = extra_nouns
@@ -648,13 +787,17 @@ class FromVideoDatasetLoaderGulp(torchDataset): #loads GTEA dataset from gulp
         self.hand_list_prefix = hand_list_prefix
         self.norm_val = [640., 480., 640., 480.]
 
-        # gulp_data_dir = r"D:\Datasets\egocentric\GTEA\gulp_output2"
-        gulp_data_dir = r"F:\workspace_George\GTEA\gteagulp"
+        assert gulp_data_dir is not None, "FromVideoDatasetLoaderGulp needs the gulp_data_dir"
         self.gd = GulpDirectory(gulp_data_dir)
         # self.items = list(self.gd.merged_meta_dict.items())
         self.merged_data_dict = self.gd.merged_meta_dict
         self.num_chunks = self.gd.num_chunks
         self.data_path = gulp_data_dir
+        # the sampled frames are read from their byte ranges in the chunk files, for any sampler pattern
+        chunk_paths = {item_id: self.gd.chunk_objs_lookup[chunk_id].data_file_path
+                       for item_id, chunk_id in self.gd.chunk_lookup.items()}
+        self.frame_reader = GulpFrameReader(self.merged_data_dict, chunk_paths)
+        self.decode_threads = decode_threads
 
     def __len__(self):
         return len(self.video_list)
@@ -669,16 +812,8 @@ class FromVideoDatasetLoaderGulp(torchDataset): #loads GTEA dataset from gulp
 
         sampled_idxs = self.sampler.sampling(range_max=frame_count, v_id=index, start_frame=0)
         # sampled_idxs = [10,11,13,14,15,15,15,15]
-        sampler_step = self.sampler.interval
-        produced_step = np.mean(sampled_idxs[1:] - np.roll(sampled_idxs,1)[1:])
-        if sampler_step[0] == produced_step:
-            sampled_frames, meta = self.gd[path, slice(sampled_idxs[0], sampled_idxs[-1]+1, sampler_step[0])]
-        else:
-            imgs, meta = self.gd[path]
-            assert sampled_idxs[-1] < len(imgs)
-            sampled_frames = []
-            for i in sampled_idxs:
-                sampled_frames.append(imgs[i])
+        assert max(sampled_idxs) < frame_count
+        sampled_frames = self.frame_reader.load_images(path, sampled_idxs, self.decode_threads)
 
         clip_input = np.concatenate(sampled_frames, axis=2)
 
@@ -902,9 +1037,11 @@ class FromVideoDatasetLoader(torchDataset): # loads gtea dataset from video file
 class VideoDatasetLoader(torchDataset):
 
     def __init__(self, sampler, list_file, num_classes=120,
-                 img_tmpl='img_{:05d}.jpg', batch_transform=None, validation=False):
-        self.sampler = sampler
+                 img_tmpl='img_{:05d}.jpg', batch_transform=None, validation=False, shard_prefix=None,
+                 frame_cache=None, decode_threads=0, clip_plan_seed=None):
         self.video_list = parse_samples_list(list_file, DataLine)
+        # with a clip_plan_seed the clips of all the segments are drawn once per epoch, see set_epoch
+        self.sampler = self.plan_clips(sampler, clip_plan_seed) if clip_plan_seed is not None else sampler
 
         # check for double output and choose as first the verb classes
         if not isinstance(num_classes, tuple):
@@ -920,24 +1057,38 @@ class VideoDatasetLoader(torchDataset):
         self.image_tmpl = img_tmpl
         self.transform = batch_transform
         self.validation = validation
+        # if given, the frames are read from the packed shards instead of the frame directories
+        self.shard_reader = FrameShardReader(shard_prefix) if shard_prefix else None
+        # optional SharedFrameCache for the decoded frames, shared by all the workers
+        self.frame_cache = frame_cache
+        # number of threads that decode the frames of one clip in each worker, 0 for serial decoding
+        self.decode_threads = decode_threads
+
+    def plan_clips(self, sampler, seed):
+        range_maxes = [video.num_frames for video in self.video_list]
+        start_frames = [video.start_frame if video.start_frame != -1 else 0 for video in self.video_list]
+        return EpochClipPlanner(sampler, range_maxes, start_frames, seed)
+
+    def set_epoch(self, epoch):
+        # plans the clips of the epoch, to be called before iterating over the dataloader
+        for sampler in getattr(self, 'samplers', [self.sampler]):
+            if isinstance(sampler, EpochClipPlanner):
+                sampler.set_epoch(epoch)
 
     def __len__(self):
         return len(self.video_list)
 
-    def __getitem__(self, index):
-        frame_count = self.video_list[index].num_frames
-        start_frame = self.video_list[index].start_frame
-        start_frame = start_frame if start_frame != -1 else 0
-        sampled_idxs = self.sampler.sampling(range_max=frame_count, v_id=index,
-                                             start_frame=start_frame)
-
-        sampled_frames = load_images(self.video_list[index].data_path, sampled_idxs, self.image_tmpl)
+    def load_clip(self, index, sampled_idxs):
+        sampled_frames = load_clip_frames(self.video_list[index].data_path, sampled_idxs, self.image_tmpl,
+                                          self.shard_reader, self.frame_cache, num_threads=self.decode_threads)
 
         clip_input = np.concatenate(sampled_frames, axis=2)
 
         if self.transform is not None:
             clip_input = self.transform(clip_input)
+        return clip_input
 
+    def get_classes(self, index):
         if self.mapping:
             verb_id = self.mapping[self.video_list[index].label_verb]
         else:
@@ -947,6 +1098,17 @@ class VideoDatasetLoader(torchDataset):
             classes = (verb_id, noun_id) # np.array([verb_id, noun_id], dtype=np.int64) should refactor to this for double output
         else:
             classes = verb_id
+        return classes
+
+    def __getitem__(self, index):
+        frame_count = self.video_list[index].num_frames
+        start_frame = self.video_list[index].start_frame
+        start_frame = start_frame if start_frame != -1 else 0
+        sampled_idxs = self.sampler.sampling(range_max=frame_count, v_id=index,
+                                             start_frame=start_frame)
+
+        clip_input = self.load_clip(index, sampled_idxs)
+        classes = self.get_classes(index)
 
         if not self.validation:
             return clip_input, classes
@@ -954,6 +1116,67 @@ class VideoDatasetLoader(torchDataset):
             return clip_input, classes, self.video_list[index].uid #self.video_list[index].data_path.split("\\")[-1]
 
 
+class VideoMultiViewDatasetLoader(VideoDatasetLoader):
+    """Returns num_views clips of every segment stacked in one tensor (num_views x C x T x H x W).
+    View i uses samplers[i] and batch_transforms[i]; the union of the frames of all the views is decoded once.
+    """
+    def __init__(self, samplers, list_file, num_classes=120, img_tmpl='img_{:05d}.jpg', batch_transforms=None,
+                 validation=False, shard_prefix=None, frame_cache=None, decode_threads=0, clip_plan_seed=None):
+        super(VideoMultiViewDatasetLoader, self).__init__(samplers[0], list_file, num_classes, img_tmpl, None,
+                                                          validation, shard_prefix, frame_cache, decode_threads)
+        assert batch_transforms is not None and len(batch_transforms) == len(samplers)
+        if clip_plan_seed is not None: # a different seed for every view
+            samplers = [self.plan_clips(sampler, clip_plan_seed + i) for i, sampler in enumerate(samplers)]
+        self.samplers = samplers
+        self.sampler = samplers[0]
+        self.transforms = batch_transforms
+
+    def __getitem__(self, index):
+        frame_count = self.video_list[index].num_frames
+        start_frame = self.video_list[index].start_frame
+        start_frame = start_frame if start_frame != -1 else 0
+        views_idxs = [sampler.sampling(range_max=frame_count, v_id=index, start_frame=start_frame)
+                      for sampler in self.samplers]
+
+        needed_idxs = sorted(set(idx for idxs in views_idxs for idx in idxs))
+        frames = load_clip_frames(self.video_list[index].data_path, needed_idxs, self.image_tmpl,
+                                  self.shard_reader, self.frame_cache, num_threads=self.decode_threads)
+        frames = dict(zip(needed_idxs, frames))
+
+        clips = []
+        for idxs, transform in zip(views_idxs, self.transforms):
+            clips.append(transform(np.concatenate([frames[idx] for idx in idxs], axis=2)))
+        clip_input = torch.stack(clips)
+        classes = self.get_classes(index)
+
+        if not self.validation:
+            return clip_input, classes
+        else:
+            return clip_input, classes, self.video_list[index].uid
+
+
+class VideoDenseDatasetLoader(VideoDatasetLoader):
+    """Every clip of every segment, the items are the windows of a DenseClipIndex over the split file and
+    return (clip, classes, segment index) so that the clip outputs can be aggregated per segment,
+    e.g. DataLoader(loader, shuffle=False) for one pass over all the clips.
+    """
+    def __init__(self, list_file, clip_length, frame_interval, num_classes=120, img_tmpl='img_{:05d}.jpg',
+                 batch_transform=None, shard_prefix=None, frame_cache=None, decode_threads=0, clip_stride=None):
+        super(VideoDenseDatasetLoader, self).__init__(None, list_file, num_classes, img_tmpl, batch_transform, True,
+                                                      shard_prefix, frame_cache, decode_threads)
+        range_maxes = [video.num_frames for video in self.video_list]
+        start_frames = [video.start_frame if video.start_frame != -1 else 0 for video in self.video_list]
+        self.clip_index = DenseClipIndex(range_maxes, start_frames, clip_length, frame_interval, clip_stride)
+
+    def __len__(self):
+        return len(self.clip_index)
+
+    def __getitem__(self, index):
+        segment = int(self.clip_index.segment_ids[index])
+        clip_input = self.load_clip(segment, self.clip_index.clips[index].tolist())
+        return clip_input, self.get_classes(segment), segment
+
+
 # TODO: this is for sliding window sample creation with a fixed sizes
 class PointPolarDatasetLoaderMultiSec(torchDataset):
     def __init__(self, list_file, max_seq_length=None, norm_val=None,
@@ -978,26 +1201,29 @@ class PointPolarDatasetLoaderMultiSec(torchDataset):
 
 class PointDiffDatasetLoader(torchDataset):
     def __init__(self, list_file, max_seq_length=None, norm_val=None,
-                 validation=False):
+                 validation=False, track_store=None, preload_workers=0, batch_features=False,
+                 feature_cache_dir=None):
         self.samples_list = parse_samples_list(list_file, DataLine)
         self.norm_val = np.array(norm_val)
         self.max_seq_length = max_seq_length
         self.validation = validation
-        self.data_arr = [load_pickle(self.samples_list[index].data_path) for index in range(len(self.samples_list))]
+        self.batch_features = batch_features # return the raw coords for TrackFeatureCollate('diffs', norm_val)
+        self.features, cache_path = None, None
+        if feature_cache_dir and max_seq_length: # only fixed size sequences are cached
+            cache_path = feature_cache_path(feature_cache_dir, list_file, 'coords' if batch_features else 'diffs',
+                                            max_seq_length, norm_val)
+            self.features = load_feature_cache(cache_path)
+        if self.features is None:
+            self.data_arr = load_point_samples(self.samples_list, None, track_store, num_workers=preload_workers)
+            if cache_path is not None:
+                self.features = build_feature_cache(cache_path, self.make_points, len(self.samples_list))
+                self.data_arr = None
 
     def __len__(self):
         return len(self.samples_list)
 
     def __getitem__(self, index):
-        left_track, right_track = load_left_right_tracks(self.data_arr[index], self.max_seq_length)
-
-        left_track /= self.norm_val[:2]
-        right_track /= self.norm_val[2:]
-
-        left_diffs = calc_distance_differences(left_track)
-        right_diffs = calc_distance_differences(right_track)
-
-        points = np.concatenate((left_track, left_diffs, right_track, right_diffs), -1).astype(np.float32)
+        points = np.array(self.features[index]) if self.features is not None else self.make_points(index)
         seq_size = len(points)
         class_id = self.samples_list[index].label_verb
         if not self.validation:
@@ -1006,14 +1232,31 @@ class PointDiffDatasetLoader(torchDataset):
             name_parts = self.samples_list[index].data_path.split("\\")
             return points, seq_size, class_id, name_parts[-2] + "\\" + name_parts[-1]
 
+    def make_points(self, index):
+        left_track, right_track = load_left_right_tracks(self.data_arr[index], self.max_seq_length)
+
+        if self.batch_features:
+            points = np.concatenate((left_track, right_track), -1)
+        else:
+            left_track /= self.norm_val[:2]
+            right_track /= self.norm_val[2:]
+
+            left_diffs = calc_distance_differences(left_track)
+            right_diffs = calc_distance_differences(right_track)
+
+            points = np.concatenate((left_track, left_diffs, right_track, right_diffs), -1).astype(np.float32)
+        return points
+
 
 class AnglesDatasetLoader(torchDataset):
-    def __init__(self, list_file, max_seq_length=None, validation=False):
+    def __init__(self, list_file, max_seq_length=None, validation=False, track_store=None, preload_workers=0,
+                 batch_features=False):
         self.samples_list = parse_samples_list(list_file, DataLine)
         # no mapping supported for now. only use all classes
         self.max_seq_length = max_seq_length
         self.validation = validation
-        self.data_arr = [load_pickle(self.samples_list[index].data_path) for index in range(len(self.samples_list))]
+        self.batch_features = batch_features # return the raw coords for TrackFeatureCollate('angles')
+        self.data_arr = load_point_samples(self.samples_list, None, track_store, num_workers=preload_workers)
 
     def __len__(self):
         return len(self.samples_list)
@@ -1021,11 +1264,14 @@ class AnglesDatasetLoader(torchDataset):
     def __getitem__(self, index):
         left_track, right_track = load_left_right_tracks(self.data_arr[index], self.max_seq_length)
 
-        left_angles = calc_angles(left_track)
-        right_angles = calc_angles(right_track)
+        if self.batch_features:
+            points = np.concatenate((left_track, right_track), -1)
+        else:
+            left_angles = calc_angles(left_track)
+            right_angles = calc_angles(right_track)
 
-        points = np.concatenate((left_angles[:, np.newaxis],
-                                 right_angles[:, np.newaxis]), -1).astype(np.float32)
+            points = np.concatenate((left_angles[:, np.newaxis],
+                                     right_angles[:, np.newaxis]), -1).astype(np.float32)
         seq_size = len(points)
 
         class_id = self.samples_list[index].label_verb
@@ -1039,37 +1285,30 @@ class AnglesDatasetLoader(torchDataset):
 class PointPolarDatasetLoader(torchDataset):
 
     def __init__(self, list_file, max_seq_length=None, norm_val=None,
-                 validation=False):
+                 validation=False, track_store=None, preload_workers=0, batch_features=False,
+                 feature_cache_dir=None):
         self.samples_list = parse_samples_list(list_file, DataLine)
         # no mapping supported for now. only use all classes
         self.norm_val = np.array(norm_val)
         self.max_seq_length = max_seq_length
         self.validation = validation
-        self.data_arr = [load_pickle(self.samples_list[index].data_path) for index in range(len(self.samples_list))]
+        self.batch_features = batch_features # return the raw coords for TrackFeatureCollate('polar', norm_val)
+        self.features, cache_path = None, None
+        if feature_cache_dir and max_seq_length: # only fixed size sequences are cached
+            cache_path = feature_cache_path(feature_cache_dir, list_file, 'coords' if batch_features else 'polar',
+                                            max_seq_length, norm_val)
+            self.features = load_feature_cache(cache_path)
+        if self.features is None:
+            self.data_arr = load_point_samples(self.samples_list, None, track_store, num_workers=preload_workers)
+            if cache_path is not None:
+                self.features = build_feature_cache(cache_path, self.make_points, len(self.samples_list))
+                self.data_arr = None
 
     def __len__(self):
         return len(self.samples_list)
 
     def __getitem__(self, index):
-        left_track, right_track = load_left_right_tracks(self.data_arr[index], self.max_seq_length)
-
-        left_angles = calc_angles(left_track)
-        right_angles = calc_angles(right_track)
-
-        left_track /= self.norm_val[:2]
-        right_track /= self.norm_val[2:]
-
-        left_dist = np.concatenate((np.array([0]),
-                                    np.diagonal(squareform(pdist(left_track)), offset=-1)))
-        right_dist = np.concatenate((np.array([0]),
-                                     np.diagonal(squareform(pdist(right_track)), offset=-1)))
-
-        points = np.concatenate((left_track,
-                                 left_dist[:, np.newaxis],
-                                 left_angles[:, np.newaxis],
-                                 right_track,
-                                 right_dist[:, np.newaxis],
-                                 right_angles[:, np.newaxis]), -1).astype(np.float32)
+        points = np.array(self.features[index]) if self.features is not None else self.make_points(index)
         seq_size = len(points)
 
         class_id = self.samples_list[index].label_verb
@@ -1079,33 +1318,70 @@ class PointPolarDatasetLoader(torchDataset):
             name_parts = self.samples_list[index].data_path.split("\\")
             return points, seq_size, class_id, name_parts[-2] + "\\" + name_parts[-1]
 
+    def make_points(self, index):
+        left_track, right_track = load_left_right_tracks(self.data_arr[index], self.max_seq_length)
+
+        if self.batch_features:
+            points = np.concatenate((left_track, right_track), -1)
+        else:
+            left_angles = calc_angles(left_track)
+            right_angles = calc_angles(right_track)
+
+            left_track /= self.norm_val[:2]
+            right_track /= self.norm_val[2:]
+
+            left_dist = calc_polar_distance_from_prev(left_track)
+            right_dist = calc_polar_distance_from_prev(right_track)
+
+            points = np.concatenate((left_track,
+                                     left_dist[:, np.newaxis],
+                                     left_angles[:, np.newaxis],
+                                     right_track,
+                                     right_dist[:, np.newaxis],
+                                     right_angles[:, np.newaxis]), -1).astype(np.float32)
+        return points
+
 
 class PointObjDatasetLoader(torchDataset):
     def __init__(self, list_file, max_seq_length, double_output,
-                 norm_val=None, bpv_prefix='noun_bpv_oh', validation=False):
+                 norm_val=None, bpv_prefix='noun_bpv_oh', validation=False, track_store=None, preload_workers=0,
+                 feature_cache_dir=None):
         self.samples_list = parse_samples_list(list_file, DataLine)
         # no mapping supported for now. only use all classes
         self.norm_val = np.array(norm_val)
         self.validation = validation
         self.double_output = double_output
         self.max_seq_length = max_seq_length
-        self.data_arr = [load_two_pickle(self.samples_list[index].data_path, bpv_prefix) for index in
-                         range(len(self.samples_list))]
+        # the object tracks are normalized once and kept as float16, memory mapped with a feature_cache_dir
+        cache_path = feature_cache_path(feature_cache_dir, list_file, 'objects_f16', 0, norm_val,
+                                        extra=bpv_prefix) if feature_cache_dir else None
+        cached = load_compact_objects(cache_path) if cache_path else None
+        if cached is not None: # only the hand tracks are loaded, not the object pickles
+            self.objects, self.object_offsets = cached
+            self.data_arr = load_point_samples(self.samples_list, None, track_store, num_workers=preload_workers)
+        else:
+            samples = load_point_samples(self.samples_list, bpv_prefix, track_store, secondary='objects',
+                                         num_workers=preload_workers)
+            self.objects, self.object_offsets = compact_objects(samples, self.norm_val, cache_path)
+            self.data_arr = samples.store.samples(self.samples_list) # only the hand tracks
+            if track_store is None:
+                samples.store.objects = None # the float32 copy of the pickles is not needed anymore
 
     def __len__(self):
         return len(self.samples_list)
 
     def __getitem__(self, index):
-        hand_tracks, object_tracks = self.data_arr[index]
+        hand_tracks = self.data_arr[index]
         left_track, right_track = load_left_right_tracks(hand_tracks, self.max_seq_length)
 
         left_track /= self.norm_val[:2]
         right_track /= self.norm_val[2:]
 
+        object_tracks = self.objects[self.object_offsets[index]:self.object_offsets[index + 1]]
         if self.max_seq_length != 0:
             object_tracks = object_tracks[
                 np.linspace(0, len(object_tracks), self.max_seq_length, endpoint=False, dtype=int)]
-        object_tracks = object_tracks / np.tile(self.norm_val[:2], 352)
+        object_tracks = object_tracks.astype(np.float32)
 
         points = np.concatenate((left_track, right_track, object_tracks),
                                 -1).astype(np.float32)
@@ -1127,7 +1403,8 @@ class PointObjDatasetLoader(torchDataset):
 
 class PointBpvDatasetLoader(torchDataset):
     def __init__(self, list_file, max_seq_length, double_output,
-                 norm_val=None, bpv_prefix='noun_bpv_oh', validation=False, num_workers=0):
+                 norm_val=None, bpv_prefix='noun_bpv_oh', validation=False, num_workers=0, track_store=None, preload_workers=0,
+                 sparse_bpv=False):
         self.samples_list = parse_samples_list(list_file, DataLine)
         # no mapping supported for now. only use all classes
         self.norm_val = np.array(norm_val)
@@ -1140,26 +1417,26 @@ class PointBpvDatasetLoader(torchDataset):
         #            self.data_arr = make_data_arr(self.samples_list, bpv_prefix)
         #        else:
         #            self.data_arr = data_arr
-        if num_workers == 0:
-            self.data_arr = load_point_samples(self.samples_list, bpv_prefix)
-        else:
-            self.data_arr = None
+        # the samples are kept in flat arrays that the workers share, so they are preloaded for any num_workers
+        self.data_arr = load_point_samples(self.samples_list, bpv_prefix, track_store, num_workers=preload_workers)
+        # the object ids instead of the 352 wide bpv, all the samples padded to the most objects of any step
+        self.sparse_bpv = sparse_bpv
+        self.max_objects = self.data_arr.store.max_objects_per_step() if sparse_bpv else 0
 
     def __len__(self):
         return len(self.samples_list)
 
     def __getitem__(self, index):
-        if self.data_arr is not None:
-            hand_tracks, object_detections = self.data_arr[index]
-        else:
-            hand_tracks, object_detections = load_two_pickle(self.samples_list[index].data_path,
-                                                             self.bpv_prefix)
+        hand_tracks, object_detections = self.data_arr[index]
         left_track, right_track = load_left_right_tracks(hand_tracks, self.max_seq_length)
 
         left_track /= self.norm_val[:2]
         right_track /= self.norm_val[2:]
 
-        bpv = object_list_to_bpv(object_detections, 352, self.max_seq_length)
+        if self.sparse_bpv:
+            bpv = object_list_to_ids(object_detections, self.max_objects, self.max_seq_length)
+        else:
+            bpv = object_list_to_bpv(object_detections, 352, self.max_seq_length)
 
         points = np.concatenate((left_track,
                                  right_track,
@@ -1183,7 +1460,7 @@ class PointBpvDatasetLoader(torchDataset):
 class PointDatasetLoader(torchDataset):
     def __init__(self, list_file, max_seq_length=None, num_classes=120,
                  batch_transform=None, norm_val=None, dual=False,
-                 clamp=False, only_left=False, only_right=False, validation=False):
+                 clamp=False, only_left=False, only_right=False, validation=False, track_store=None, preload_workers=0):
         self.samples_list = parse_samples_list(list_file, DataLine)
         if num_classes != 120 and num_classes != 125:  # TODO: find a better way to apply mapping
             self.mapping = make_class_mapping(self.samples_list)
@@ -1197,7 +1474,7 @@ class PointDatasetLoader(torchDataset):
         self.only_left = only_left
         self.only_right = only_right
 
-        self.data_arr = load_point_samples(self.samples_list, None)
+        self.data_arr = load_point_samples(self.samples_list, None, track_store, num_workers=preload_workers)
 
     def __len__(self):
         return len(self.samples_list)
@@ -1245,7 +1522,8 @@ class PointDatasetLoader(torchDataset):
 class VideoAndPointDatasetLoader(torchDataset):
     EPIC_MAX_CLASSES = [2521, 125, 322]
     def __init__(self, sampler, video_list_file, point_list_prefix, num_classes, img_tmpl='img_{:05d}.jpg', # removed predefined argument from num_classes
-                 norm_val=None, batch_transform=None, use_hands=True, validation=False, vis_data=False):
+                 norm_val=None, batch_transform=None, use_hands=True, validation=False, vis_data=False,
+                 shard_prefix=None, frame_cache=None, decode_threads=0):
         self.sampler = sampler
         self.video_list = parse_samples_list(video_list_file, DataLine)
 
@@ -1272,6 +1550,9 @@ class VideoAndPointDatasetLoader(torchDataset):
         self.validation = validation
         self.norm_val = np.array(norm_val)
         self.vis_data = vis_data
+        self.shard_reader = FrameShardReader(shard_prefix) if shard_prefix else None
+        self.frame_cache = frame_cache
+        self.decode_threads = decode_threads
 
     def __len__(self):
         return len(self.video_list)
@@ -1285,7 +1566,8 @@ class VideoAndPointDatasetLoader(torchDataset):
         sampled_idxs = self.sampler.sampling(range_max=frame_count, v_id=index, start_frame=start_frame)
         # sampled_idxs = list(range(start_frame, start_frame + frame_count + 1))
 
-        sampled_frames = load_images(self.video_list[index].data_path, sampled_idxs, self.image_tmpl)
+        sampled_frames = load_clip_frames(self.video_list[index].data_path, sampled_idxs, self.image_tmpl,
+                                          self.shard_reader, self.frame_cache, num_threads=self.decode_threads)
 
         clip_input = np.concatenate(sampled_frames, axis=2)
         or_h, or_w, _ = clip_input.shape
@@ -1411,7 +1693,7 @@ class VideoAndPointDatasetLoader(torchDataset):
 
 class PointVectorSummedDatasetLoader(torchDataset):
     def __init__(self, list_file, max_seq_length=None, num_classes=120,
-                 dual=False, validation=False):
+                 dual=False, validation=False, track_store=None, preload_workers=0, batch_features=False):
         self.samples_list = parse_samples_list(list_file, DataLine)
         if num_classes != 120:
             self.mapping = make_class_mapping(self.samples_list)
@@ -1420,8 +1702,10 @@ class PointVectorSummedDatasetLoader(torchDataset):
         self.validation = validation
         self.max_seq_length = max_seq_length
         self.dual = dual
+        # return the full raw tracks for TrackFeatureCollate('vec_sum'/'vec_sum_dual', max_seq_length=max_seq_length)
+        self.batch_features = batch_features
 
-        self.data_arr = [load_pickle(self.samples_list[index].data_path) for index in range(len(self.samples_list))]
+        self.data_arr = load_point_samples(self.samples_list, None, track_store, num_workers=preload_workers)
 
     def __len__(self):
         return len(self.samples_list)
@@ -1429,31 +1713,19 @@ class PointVectorSummedDatasetLoader(torchDataset):
     def __getitem__(self, index):
         #        hand_tracks = load_pickle(self.samples_list[index].data_path)
         hand_tracks = self.data_arr[index]
-        left_track = np.array(hand_tracks['left'], dtype=np.int)
-        right_track = np.array(hand_tracks['right'], dtype=np.int)
-
-        feat_size = 456 + 256
-        feat_addon = 0
-        if self.dual:
-            feat_addon = feat_size
-            feat_size *= 2
-
-        vec = np.zeros((len(left_track), feat_size), dtype=np.float32)
-        for i in range(len(left_track)):
-            xl, yl = left_track[i]
-            xr, yr = right_track[i]
-            if yl < 256:
-                vec[i:, xl] += 1
-                vec[i:, 456 + yl] += 1
-            if yr < 256:
-                vec[i:, feat_addon + xr] += 1
-                vec[i:, feat_addon + 456 + yr] += 1
+        left_track = np.array(hand_tracks['left'], dtype=int)
+        right_track = np.array(hand_tracks['right'], dtype=int)
 
-        if self.max_seq_length != 0:
-            vec = vec[np.linspace(0, len(vec), self.max_seq_length, endpoint=False, dtype=int)]
-            seq_size = self.max_seq_length
-        else:
+        if self.batch_features:
+            vec = np.concatenate((left_track, right_track), -1).astype(np.float32)
             seq_size = len(left_track)
+        else:
+            vec = calc_vec_sum(left_track, right_track, self.dual)
+            if self.max_seq_length != 0:
+                vec = vec[np.linspace(0, len(vec), self.max_seq_length, endpoint=False, dtype=int)]
+                seq_size = self.max_seq_length
+            else:
+                seq_size = len(left_track)
 
         if self.mapping:
             class_id = self.mapping[self.samples_list[index].label_verb]
@@ -1468,33 +1740,27 @@ class PointVectorSummedDatasetLoader(torchDataset):
 
 
 class PointImageDatasetLoader(torchDataset):
-    sum_seq_size = 0
-
     def __init__(self, list_file, batch_transform=None, norm_val=None,
-                 validation=False):
+                 validation=False, scale=1, max_frames=0, max_mb=0):
         self.samples_list = parse_samples_list(list_file, DataLine)
         self.transform = batch_transform
         self.norm_val = np.array(norm_val)
         self.validation = validation
+        # the trail images of the last max_frames steps (or max_mb of them), at 1/scale of 256x456
+        self.rasterizer = TrailRasterizer(256, 456, scale, max_frames, max_mb)
+        self.path_index = SamplePathIndex([sample.data_path for sample in self.samples_list])
+        self.path_index.check()
 
     def __len__(self):
         return len(self.samples_list)
 
     def __getitem__(self, index):
-        hand_tracks = load_pickle(self.samples_list[index].data_path)
-        left_track = np.array(hand_tracks['left'], dtype=np.int)
-        right_track = np.array(hand_tracks['right'], dtype=np.int)
-
-        seq_size = len(left_track)
-        #        print(seq_size)
-        self.sum_seq_size += seq_size
-        print(self.sum_seq_size)
-        point_imgs = np.zeros([385, 456, seq_size], dtype=np.float32)
+        hand_tracks = load_pickle(self.path_index.paths(self.samples_list[index].data_path))
+        left_track = np.array(hand_tracks['left'], dtype=int)
+        right_track = np.array(hand_tracks['right'], dtype=int)
 
-        for i in range(seq_size):
-            intensities = np.linspace(1., 0., i + 1)[::-1]
-            point_imgs[left_track[:i + 1, 1], left_track[:i + 1, 0], i] = intensities
-            point_imgs[right_track[:i + 1, 1], right_track[:i + 1, 0], i] = intensities
+        point_imgs = self.rasterizer(left_track, right_track)
+        seq_size = point_imgs.shape[2]
 
         #        for i in range(seq_size):
         #            for j in range(i+1):
@@ -1508,7 +1774,7 @@ class PointImageDatasetLoader(torchDataset):
         #                cv2.waitKey(5)
         #        cv2.waitKey(0)
 
-        return point_imgs[:256, :, :], seq_size, self.samples_list[index].label_verb
+        return point_imgs, seq_size, self.samples_list[index].label_verb
 
 if __name__=='__main__':
     # video_list_file = r"D:\Code\hand_track_classification\splits\epic_rgb_select2_56_nd\epic_rgb_train_1.txt"
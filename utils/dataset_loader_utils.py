@@ -13,9 +13,16 @@ import numpy as np
 import cv2
 
 from torch._six import string_classes, int_classes
+from torch.utils.data.dataloader import default_collate
 import re
-import collections
+import ctypes
+import collections.abc
+import multiprocessing as mp
 import torch
+try:
+    import resource
+except ImportError: # not available on windows
+    resource = None
 
 #### Custom image transforms ####
 
@@ -200,6 +207,12 @@ class Resize(object):
     def get_new_shape(self):
         return self.new_shape
 
+    def get_min_input_size(self):
+        ''' Smallest (w, h) of the input that does not need upscaling; used as decode size hint'''
+        if isinstance(self.size, int):
+            return (self.size, self.size)
+        return tuple(self.size)
+
 class CenterCrop(object):
     """Crops the given numpy array at the center to have a region of
     the given size. size can be a tuple (target_height, target_width)
@@ -293,6 +306,21 @@ class RandomScale(object):
 
     def get_new_size(self):
         return self.new_size
+
+    def get_min_input_size(self):
+        ''' Smallest (w, h) of the input that does not need upscaling for any of the random scales; used as decode size hint'''
+        max_len = int(self.slen[1] * (self.aspect_ratio[1] if self.aspect_ratio else 1.0)) + 1
+        return (max_len, max_len)
+
+def get_decode_size_hint(transform):
+    """Returns the (w, h) size the frames need to have for the first transform of the pipeline,
+    or None if the pipeline does not start with a resize"""
+    if transform is None:
+        return None
+    first_transform = transform.transforms[0] if hasattr(transform, 'transforms') else transform
+    if hasattr(first_transform, 'get_min_input_size'):
+        return first_transform.get_min_input_size()
+    return None
     
 class RandomHLS(object):
     def __init__(self, vars=[15, 35, 25]):
@@ -305,23 +333,16 @@ class RandomHLS(object):
 
         random_vars = [int(round(self.rng.uniform(-x, x))) for x in self.vars]
 
-        base = len(random_vars)
-        augmented_data = np.zeros(data.shape, )
+        # stays in uint8, only the shifted hls frame is int16; same values as the former float64 buffer
+        shift = np.array(random_vars, dtype=np.int16)
+        hls_limits = np.array([180, 255, 255], dtype=np.int16)
+        augmented_data = np.empty(data.shape, dtype=np.uint8)
 
         for i_im in range(0, int(c/3)):
-            augmented_data[:,:,3*i_im:(3*i_im+3)] = \
-                    cv2.cvtColor(data[:,:,3*i_im:(3*i_im+3)], cv2.COLOR_RGB2HLS)
-
-        hls_limits = [180, 255, 255]
-        for ic in range(0, c):
-            var = random_vars[ic%base]
-            limit = hls_limits[ic%base]
-            augmented_data[:,:,ic] = np.minimum(np.maximum(augmented_data[:,:,ic] + var, 0), limit)
-
-        for i_im in range(0, int(c/3)):
-            augmented_data[:,:,3*i_im:(3*i_im+3)] = \
-                    cv2.cvtColor(augmented_data[:,:,3*i_im:(3*i_im+3)].astype(np.uint8), \
-                        cv2.COLOR_HLS2RGB)
+            hls = cv2.cvtColor(data[:,:,3*i_im:(3*i_im+3)], cv2.COLOR_RGB2HLS).astype(np.int16)
+            hls += shift
+            np.clip(hls, 0, hls_limits, out=hls)
+            augmented_data[:,:,3*i_im:(3*i_im+3)] = cv2.cvtColor(hls.astype(np.uint8), cv2.COLOR_HLS2RGB)
 
         return augmented_data
 
@@ -339,8 +360,104 @@ class ToTensorVid(object):
             clips = torch.from_numpy(clips.reshape((H,W,-1,self.dim)).transpose((3, 2, 0, 1)))
             # backward compatibility
             return clips.float() / 255.0
+
+class ToUint8TensorVid(object):
+    """Converts a numpy.ndarray (H x W x (T x C)) to a torch.ByteTensor view of shape (C x T x H x W) without
+    scaling, to be used instead of ToTensorVid + Normalize with BatchNormalizeVid on the collated batch.
+    """
+    def __init__(self, dim=3):
+        self.dim = dim
+
+    def __call__(self, clips):
+        H, W, _ = clips.shape
+        return torch.from_numpy(np.ascontiguousarray(clips, dtype=np.uint8)).view(H, W, -1, self.dim).permute(3, 2, 0, 1)
+
+class BatchNormalizeVid(object):
+    """Scales to [0, 1] and normalizes with mean/std a uint8 batch (B x C x T x H x W) of clips in one pass,
+    i.e. (x / 255 - mean) / std computed as x * (1 / (255 * std)) - mean / std.
+    """
+    def __init__(self, mean, std):
+        std = torch.tensor(std, dtype=torch.float32)
+        self.scale = (1. / (255. * std)).view(1, -1, 1, 1, 1)
+        self.bias = (-torch.tensor(mean, dtype=torch.float32) / std).view(1, -1, 1, 1, 1)
+
+    def __call__(self, batch):
+        if self.scale.device != batch.device:
+            self.scale, self.bias = self.scale.to(batch.device), self.bias.to(batch.device)
+        return torch.addcmul(self.bias, batch.float(), self.scale)
+
+class BatchNormalizedLoader(object):
+    """Iterates over a DataLoader whose samples are ToUint8TensorVid clips and yields the batches with the clips
+    (first element of the batch) moved to the device and normalized with BatchNormalizeVid there, so the workers
+    and the dataloader queues only handle uint8 data.
+    """
+    def __init__(self, data_loader, mean, std, device=None):
+        self.data_loader = data_loader
+        self.batch_normalize = BatchNormalizeVid(mean, std)
+        self.device = device
+
+    def __len__(self):
+        return len(self.data_loader)
+
+    def __iter__(self):
+        for batch in self.data_loader:
+            clips = batch[0]
+            if self.device is not None:
+                clips = clips.to(self.device, non_blocking=True)
+            yield [self.batch_normalize(clips)] + list(batch[1:])
+
 #### Custom collate functions
 
+def get_private_dirty_kb():
+    ''' memory written by this process itself (in KB), which for a forked worker includes the pages of the
+    parent that were copied on write, e.g. by touching the refcounts of preloaded python objects. linux only '''
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Private_Dirty:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class WorkerPeakRSS(object):
+    """Wraps the collate function of a DataLoader to keep the peak resident memory of every worker,
+    which is updated after each batch the worker collates. Use as DataLoader(..., collate_fn=peak_rss,
+    worker_init_fn=peak_rss.worker_init_fn) and print it to get the peaks in MB.
+    The RSS also counts the pages shared with the main process, so where available the peak private memory
+    of the workers is kept as well, it is the one that grows with the copies of the preloaded datasets.
+    """
+    def __init__(self, num_workers, collate_fn=default_collate):
+        self.collate_fn = collate_fn
+        self.peaks = mp.RawArray(ctypes.c_int64, max(num_workers, 1)) # in KB, index 0 is also the main process for num_workers == 0
+        self.private_peaks = mp.RawArray(ctypes.c_int64, max(num_workers, 1))
+        self.worker_id = 0
+
+    def worker_init_fn(self, worker_id):
+        self.worker_id = worker_id
+
+    def __call__(self, batch):
+        collated = self.collate_fn(batch)
+        if resource is not None:
+            self.peaks[self.worker_id] = max(self.peaks[self.worker_id], resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+        private_kb = get_private_dirty_kb()
+        if private_kb is not None:
+            self.private_peaks[self.worker_id] = max(self.private_peaks[self.worker_id], private_kb)
+        return collated
+
+    def __repr__(self):
+        if resource is None:
+            return "Worker peak RSS not available on this platform"
+        peaks_mb = [p / 1024 for p in self.peaks]
+        text = "Worker peak RSS (MB): {}, max {:.1f}".format(", ".join("{:.1f}".format(p) for p in peaks_mb),
+                                                             max(peaks_mb))
+        private_mb = [p / 1024 for p in self.private_peaks]
+        if max(private_mb) > 0:
+            text += "\nWorker peak private memory (MB): {}, max {:.1f}".format(
+                ", ".join("{:.1f}".format(p) for p in private_mb), max(private_mb))
+        return text
+
 numpy_type_map = {
     'float64': torch.DoubleTensor,
     'float32': torch.FloatTensor,
@@ -352,6 +469,66 @@ numpy_type_map = {
     'uint8': torch.ByteTensor,
 }
 
+def new_batch_buffer(shape):
+    # uninitialized, pad_sequences only zeros the padding and packed inputs have none
+    if torch.utils.data.get_worker_info() is not None:
+        # in a background process, pad directly into a shared memory tensor to avoid an extra copy
+        # when the batch is sent to the main process
+        storage = torch.FloatStorage._new_shared(int(np.prod(shape)))
+        return torch.FloatTensor(storage).view(shape)
+    return torch.empty(shape, dtype=torch.float32)
+
+def pad_sequences(batch):
+    """Pads the [seq_size, ...] inputs of the (inputs, seq_size, ...) samples of a batch into one
+    [batch_size, max_seq_size, ...] float tensor, sorted descending according to the sequence lengths.
+    Returns it with the sorted lengths and the sort order (indices in batch) as LongTensors"""
+    seq_lengths = np.array([sample[1] for sample in batch], dtype=np.int64)
+    order_desc = np.argsort(seq_lengths)[::-1].copy()
+    sorted_lengths = seq_lengths[order_desc]
+    inputs = [np.asarray(batch[i][0]) for i in order_desc]
+    padded = new_batch_buffer((len(batch), int(sorted_lengths[0])) + inputs[0].shape[1:])
+    padded_np = padded.numpy() # same memory, numpy assignments have less overhead per sample
+    for i, (sample_inputs, seq_size) in enumerate(zip(inputs, sorted_lengths.tolist())):
+        padded_np[i, :seq_size] = sample_inputs[:seq_size]
+        padded_np[i, seq_size:] = 0
+    return padded, torch.from_numpy(sorted_lengths), torch.from_numpy(order_desc)
+
+def pack_sequences(batch):
+    """Packs the [seq_size, ...] inputs of the (inputs, seq_size, ...) samples of a batch directly into a
+    PackedSequence, the same as pack_padded_sequence of the pad_sequences output without the padded tensor.
+    Step t of the sorted sample b is row step_offsets[t] + b of the packed data.
+    Returns it with the sorted lengths and the sort order as LongTensors"""
+    seq_lengths = np.array([sample[1] for sample in batch], dtype=np.int64)
+    order_desc = np.argsort(seq_lengths)[::-1].copy()
+    sorted_lengths = seq_lengths[order_desc]
+    inputs = [np.asarray(batch[i][0]) for i in order_desc]
+    max_seq_size = int(sorted_lengths[0])
+    # the number of sequences longer than t for every step t
+    batch_sizes = len(batch) - np.cumsum(np.bincount(sorted_lengths, minlength=max_seq_size + 1))[:max_seq_size]
+    step_offsets = np.cumsum(batch_sizes) - batch_sizes
+    packed = new_batch_buffer((int(sorted_lengths.sum()),) + inputs[0].shape[1:])
+    packed_np = packed.numpy()
+    for i, (sample_inputs, seq_size) in enumerate(zip(inputs, sorted_lengths.tolist())):
+        packed_np[step_offsets[:seq_size] + i] = sample_inputs[:seq_size]
+    packed = torch.nn.utils.rnn.PackedSequence(packed, torch.from_numpy(batch_sizes))
+    return packed, torch.from_numpy(sorted_lengths), torch.from_numpy(order_desc)
+
+def packed_lstm_collate(batch):
+    """lstm_collate for the models that take a PackedSequence (e.g. LSTM_Hands, LSTM_per_hand), the inputs are
+    packed in the worker instead of padded and packed again by the model"""
+    packed_inputs, seq_lengths, order_desc = pack_sequences(batch)
+    collated = [packed_inputs, seq_lengths]
+    for field in range(2, len(batch[0])):
+        collated.append(lstm_collate(tuple(batch[i][field] for i in order_desc.tolist())))
+    return collated
+
+def lstm_inputs_to_gpu(inputs, requires_grad=False):
+    # the padded [batch, seq, ...] inputs of lstm_collate as [seq, batch, ...], or the PackedSequence of packed_lstm_collate
+    if isinstance(inputs, torch.nn.utils.rnn.PackedSequence):
+        return inputs.cuda()
+    inputs = torch.tensor(inputs, requires_grad=requires_grad).cuda()
+    return inputs.transpose(1, 0)
+
 def lstm_collate(batch):
     r"""Puts each data field into a tensor with outer dimension batch size"""
 
@@ -387,39 +564,15 @@ def lstm_collate(batch):
         return torch.DoubleTensor(batch)
     elif isinstance(batch[0], string_classes):
         return batch
-    elif isinstance(batch[0], collections.Mapping):
+    elif isinstance(batch[0], collections.abc.Mapping):
         return {key: lstm_collate([d[key] for d in batch]) for key in batch[0]}
-    elif isinstance(batch[0], collections.Sequence):
-        # get the sequence lengths for all the samples of the batch
-        seq_lengths = np.array([batch[i][1] for i in range(len(batch))])
-        order_desc = np.argsort(seq_lengths)[::-1]
-        max_seq_size = seq_lengths[order_desc][0]
-        feature_size = len(batch[0][0][0])
-#        num_times_feature = 1 if len(batch.shape)==3 else batch.shape[4]
-        # sort the batch items descending according to the sequence lengths
-        padded_batch = []
-        for i, order in enumerate(order_desc):
-#            if num_times_feature == 1:
-            padded_inputs = np.zeros((max_seq_size, feature_size), dtype=np.float32)
-#            else:
-#                padded_inputs = np.zeros((1, max_seq_size, feature_size, num_times_feature), dtype=np.float32)
-                
-            padded_inputs[:batch[order][1], :] = batch[order][0]
-                
-            if len(batch[order]) == 4:
-                appendable = (padded_inputs, batch[order][1], batch[order][2], batch[order][3])
-            else:
-                appendable = (padded_inputs, batch[order][1], batch[order][2])
-            padded_batch.append(appendable)
-        
-        transposed = zip(*padded_batch)
-        collated = []
-        
-        for samples in transposed:
-            res = lstm_collate(samples)
-            collated.append(res)
+    elif isinstance(batch[0], collections.abc.Sequence):
+        # (inputs, seq_size, labels...) samples, sorted descending according to the sequence lengths
+        padded_inputs, seq_lengths, order_desc = pad_sequences(batch)
+        collated = [padded_inputs, seq_lengths]
+        for field in range(2, len(batch[0])):
+            collated.append(lstm_collate(tuple(batch[i][field] for i in order_desc.tolist())))
         return collated
-        #return [my_collate(samples) for samples in transposed]
 
     raise TypeError((error_msg.format(type(batch[0]))))    
     
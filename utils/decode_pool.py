@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""
+Thread pool for decoding the frames of a single clip concurrently
+
+cv2.imread/cv2.imdecode release the GIL, so the frames of one clip can be decoded in parallel
+inside a single dataloader worker. The pool is created lazily in the process that uses it, so every
+dataloader worker gets its own threads (a pool inherited through fork has no running threads).
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+_pools = {}
+
+
+def get_decode_pool(num_threads):
+    key = (os.getpid(), num_threads)
+    pool = _pools.get(key)
+    if pool is None:
+        pool = ThreadPoolExecutor(max_workers=num_threads)
+        _pools[key] = pool
+    return pool
+
+
+def map_frames(fn, items, num_threads=0):
+    # num_threads <= 1 keeps the serial decoding of the frames
+    if num_threads <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+    return list(get_decode_pool(num_threads).map(fn, items))
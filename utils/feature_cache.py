@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+On disk cache of the lstm input features of a split file
+
+With a fixed lstm_seq_size the inputs of PointDiffDatasetLoader and PointPolarDatasetLoader only depend on the
+split file, the feature type, the sequence size and the normalization values. The first run computes them for
+all the samples into one [num_samples, seq_size, feature_size] float32 .npy file, named after the hash of these
+(the contents of the split file, not its path), and the next runs memory map it instead of loading the pickles
+and making the features again.
+"""
+
+import os
+import hashlib
+import tempfile
+
+import numpy as np
+
+FEATURE_CACHE_VERSION = 1 # change to invalidate the caches when the features are computed differently
+
+
+def feature_cache_path(cache_dir, list_file, feature, max_seq_length, norm_val, extra=None):
+    # extra is anything else the features depend on, e.g. the prefix of the object pickles
+    key = hashlib.sha1()
+    with open(list_file, 'rb') as f:
+        key.update(f.read())
+    norm_val = None if norm_val is None else [float(v) for v in norm_val]
+    key.update(repr((feature, int(max_seq_length), norm_val, extra, FEATURE_CACHE_VERSION)).encode())
+    return os.path.join(cache_dir, "{}_seq{}_{}.npy".format(feature, max_seq_length, key.hexdigest()))
+
+
+def load_feature_cache(cache_path):
+    if not os.path.exists(cache_path):
+        return None
+    return np.load(cache_path, mmap_mode='r')
+
+
+def remove_quietly(path):
+    # e.g. a memory map of the file is still open on windows
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def build_feature_cache(cache_path, make_points, num_samples):
+    """Writes make_points(i) of every sample to cache_path and returns it memory mapped"""
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    # a unique name in the cache directory, runs that build the same cache at the same time do not write
+    # into each other's file and the last os.replace wins
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix='.npy')
+    os.close(fd)
+    try:
+        first = make_points(0)
+        features = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                             shape=(num_samples,) + first.shape)
+        features[0] = first
+        for i in range(1, num_samples):
+            features[i] = make_points(i)
+        features.flush()
+        del features
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        remove_quietly(tmp_path)
+        raise
+    print("Feature cache {}: {} samples".format(cache_path, num_samples))
+    return load_feature_cache(cache_path)
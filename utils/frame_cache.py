@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Decoded frame cache shared between the dataloader workers
+
+The cache is a fixed pool of frame sized slots in shared memory, allocated in the main process
+before the workers are started so every worker sees the same slots. Frames are keyed by
+(video path, frame index) and the least recently used slot is replaced when the pool is full.
+"""
+
+import ctypes
+import hashlib
+import multiprocessing as mp
+
+import numpy as np
+
+EMPTY_KEY = -1
+
+
+def path_key(data_path):
+    # python's hash() is salted per process, so use a stable hash of the path that is the same in every worker
+    return int.from_bytes(hashlib.md5(data_path.encode('utf-8')).digest()[:8], 'little', signed=True) & 0x7fffffffffffffff
+
+
+class SharedFrameCache(object):
+    def __init__(self, max_bytes, frame_shape=(256, 456, 3)):
+        self.slot_bytes = int(np.prod(frame_shape))
+        self.num_slots = int(max_bytes // self.slot_bytes)
+        assert self.num_slots > 0, "Frame cache of {} bytes cannot hold a {} frame".format(max_bytes, frame_shape)
+        self.max_bytes = self.num_slots * self.slot_bytes
+        self.lock = mp.Lock()
+        self._data = mp.RawArray(ctypes.c_uint8, self.max_bytes)
+        self._keys = mp.RawArray(ctypes.c_int64, self.num_slots * 2)
+        self._shapes = mp.RawArray(ctypes.c_int32, self.num_slots * 3)
+        self._ticks = mp.RawArray(ctypes.c_int64, self.num_slots)
+        self._stats = mp.RawArray(ctypes.c_int64, 3) # hits, misses, clock
+        self._make_views()
+        self.keys[:] = EMPTY_KEY
+        self.path_keys = {}
+
+    def _make_views(self):
+        self.data = np.frombuffer(self._data, dtype=np.uint8).reshape(self.num_slots, self.slot_bytes)
+        self.keys = np.frombuffer(self._keys, dtype=np.int64).reshape(self.num_slots, 2)
+        self.shapes = np.frombuffer(self._shapes, dtype=np.int32).reshape(self.num_slots, 3)
+        self.ticks = np.frombuffer(self._ticks, dtype=np.int64)
+        self.stats = np.frombuffer(self._stats, dtype=np.int64)
+
+    def __getstate__(self): # for spawned workers pass the shared arrays and rebuild the numpy views on the other side
+        state = self.__dict__.copy()
+        for name in ['data', 'keys', 'shapes', 'ticks', 'stats']:
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._make_views()
+
+    def _path_key(self, data_path):
+        key = self.path_keys.get(data_path)
+        if key is None:
+            key = path_key(data_path)
+            self.path_keys[data_path] = key
+        return key
+
+    def _find(self, key, frame_index):
+        slots = np.flatnonzero((self.keys[:, 1] == frame_index) & (self.keys[:, 0] == key))
+        return slots[0] if len(slots) > 0 else -1
+
+    def get(self, data_path, frame_index):
+        key = self._path_key(data_path)
+        with self.lock:
+            slot = self._find(key, frame_index)
+            if slot < 0:
+                self.stats[1] += 1
+                return None
+            self.stats[0] += 1
+            self.stats[2] += 1
+            self.ticks[slot] = self.stats[2]
+            h, w, c = self.shapes[slot]
+            return self.data[slot, :h * w * c].reshape(h, w, c).copy()
+
+    def put(self, data_path, frame_index, frame):
+        if frame.dtype != np.uint8 or frame.ndim != 3 or frame.nbytes > self.slot_bytes:
+            return False
+        key = self._path_key(data_path)
+        with self.lock:
+            if self._find(key, frame_index) >= 0: # another worker decoded it in the meantime
+                return True
+            empty = np.flatnonzero(self.keys[:, 0] == EMPTY_KEY)
+            slot = empty[0] if len(empty) > 0 else np.argmin(self.ticks)
+            self.data[slot, :frame.nbytes] = frame.reshape(-1)
+            self.shapes[slot] = frame.shape
+            self.keys[slot] = (key, frame_index)
+            self.stats[2] += 1
+            self.ticks[slot] = self.stats[2]
+        return True
+
+    def load_images(self, data_path, frame_indices, load_fn):
+        """Returns the frames for frame_indices, decoding with load_fn(frame_indices) only the ones missing from the cache"""
+        frames = {}
+        for f_ind in frame_indices:
+            if f_ind not in frames:
+                frames[f_ind] = self.get(data_path, f_ind)
+        missing = [f_ind for f_ind, frame in frames.items() if frame is None]
+        if missing:
+            for f_ind, frame in zip(missing, load_fn(missing)):
+                self.put(data_path, f_ind, frame)
+                frames[f_ind] = frame
+        return [frames[f_ind] for f_ind in frame_indices]
+
+    def get_stats(self):
+        hits, misses = int(self.stats[0]), int(self.stats[1])
+        used_slots = int(np.count_nonzero(self.keys[:, 0] != EMPTY_KEY))
+        return {'hits': hits, 'misses': misses,
+                'hit_rate': hits / (hits + misses) if hits + misses > 0 else 0.,
+                'used_bytes': used_slots * self.slot_bytes, 'max_bytes': self.max_bytes}
+
+    def __repr__(self):
+        stats = self.get_stats()
+        return "SharedFrameCache(hits {}, misses {}, hit rate {:.3f}, used {:.1f}/{:.1f} MB)".format(
+            stats['hits'], stats['misses'], stats['hit_rate'], stats['used_bytes'] / 2**20, stats['max_bytes'] / 2**20)
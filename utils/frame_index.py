@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Frame count index for the datasets that are read from frame directories
+
+Instead of listing the frame directory of a sample on every __getitem__, the frame count of every directory
+in a split file is found once (with a thread pool, the listdir calls are i/o bound) and saved next to the
+split file as '<split_file>.frame_index.pkl'. On later runs only the directories whose mtime changed since
+the index was saved are listed again.
+"""
+
+import os
+import pickle
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+FRAME_INDEX_EXT = '.frame_index.pkl'
+
+
+def count_frames(frames_path):
+    mtime = os.stat(frames_path).st_mtime_ns
+    return mtime, len(os.listdir(frames_path))
+
+
+def load_frame_index(index_path):
+    if not os.path.exists(index_path):
+        return {}
+    try:
+        with open(index_path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        print("Frame index {} is unreadable, it will be rebuilt".format(index_path))
+        return {}
+
+
+def save_frame_index(index_path, frame_index):
+    try:
+        # a unique temp name, runs that save the index of the same split at the same time do not write
+        # into the same file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(index_path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(frame_index, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, index_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    except OSError as e: # e.g. read only dataset directory, the index is then rebuilt on every run
+        print("Could not save frame index {}: {}".format(index_path, e))
+
+
+def build_frame_index(split_file, frames_paths, num_workers=8):
+    """Returns {frames_path: frame_count} for the given frame directories, reusing the saved index of the
+    split file for the directories that have not been modified"""
+    index_path = split_file + FRAME_INDEX_EXT
+    frame_index = load_frame_index(index_path) # {frames_path: (mtime_ns, frame_count)}
+    unique_paths = sorted(set(frames_paths))
+
+    with ThreadPoolExecutor(max_workers=max(num_workers, 1)) as pool:
+        mtimes = dict(zip(unique_paths, pool.map(lambda p: os.stat(p).st_mtime_ns, unique_paths)))
+        stale = [p for p in unique_paths if p not in frame_index or frame_index[p][0] != mtimes[p]]
+        for frames_path, entry in zip(stale, pool.map(count_frames, stale)):
+            frame_index[frames_path] = entry
+
+    if stale:
+        print("Frame index {}: counted {} of {} frame directories".format(index_path, len(stale), len(unique_paths)))
+        save_frame_index(index_path, frame_index)
+    return {p: frame_index[p][1] for p in unique_paths}
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Packed frame shards for the rgb video loaders
+
+Every video directory with 'frame_{:010d}.jpg' files is packed into a single
+.shard file which holds the jpeg bytes of all the frames back to back,
+followed by the offset index and a small footer:
+
+    [jpeg bytes of frame first_frame ... last_frame]
+    [int64 offsets, num_frames + 1 values]
+    [footer: magic, first_frame, num_frames]
+
+so that the loader can read any sampled frame with a positioned read on an
+already opened file instead of opening a new file per frame.
+The chunk files of a gulp directory are read the same way by GulpFrameReader.
+"""
+
+import os
+import re
+import struct
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from utils.decode_pool import map_frames
+from utils.path_index import prefixed_path
+
+SHARD_EXT = '.shard'
+SHARD_MAGIC = b'HTCSHRD1'
+SHARD_FOOTER = struct.Struct('<8sqq')
+
+
+def shard_path_from_data_path(data_path, shard_prefix):
+    # the first part of the path is replaced by the shard prefix, as for the secondary pickles
+    return prefixed_path(data_path, shard_prefix) + SHARD_EXT
+
+
+def list_frame_numbers(video_dir, frame_pattern=r'frame_(\d+)\.jpg$'):
+    regex = re.compile(frame_pattern)
+    frame_numbers = []
+    for name in os.listdir(video_dir):
+        match = regex.match(name)
+        if match:
+            frame_numbers.append(int(match.group(1)))
+    return sorted(frame_numbers)
+
+
+def pack_video_frames(video_dir, shard_path, img_tmpl='frame_{:010d}.jpg'):
+    frame_numbers = list_frame_numbers(video_dir)
+    assert len(frame_numbers) > 0, "No frames found in {}".format(video_dir)
+    first_frame, last_frame = frame_numbers[0], frame_numbers[-1]
+    num_frames = last_frame - first_frame + 1
+    assert num_frames == len(frame_numbers), "Missing frames in {}".format(video_dir)
+
+    os.makedirs(os.path.dirname(shard_path) or '.', exist_ok=True)
+    offsets = np.zeros(num_frames + 1, dtype=np.int64)
+    tmp_path = shard_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        for i in range(num_frames):
+            with open(os.path.join(video_dir, img_tmpl.format(first_frame + i)), 'rb') as im_f:
+                f.write(im_f.read())
+            offsets[i + 1] = f.tell()
+        f.write(offsets.tobytes())
+        f.write(SHARD_FOOTER.pack(SHARD_MAGIC, first_frame, num_frames))
+    os.replace(tmp_path, shard_path)
+    return num_frames
+
+
+REDUCED_DECODE_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                        4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+def positioned_read(fd, length, offset, lock):
+    if hasattr(os, 'pread'):
+        return os.pread(fd, length, offset)
+    # windows has no pread, the seek and the read share the file offset of fd with the other decode threads
+    with lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.read(fd, length)
+
+
+def decode_frame(buffer, reduce_factor=1):
+    image = cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8), REDUCED_DECODE_FLAGS[reduce_factor])
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+class FrameShard(object):
+    """An open shard file; frames are read with positioned reads on a single file descriptor"""
+    def __init__(self, shard_path):
+        self.shard_path = shard_path
+        self.lock = threading.Lock()
+        self.fd = os.open(shard_path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        file_size = os.fstat(self.fd).st_size
+        magic, self.first_frame, self.num_frames = SHARD_FOOTER.unpack(
+            self._read(file_size - SHARD_FOOTER.size, SHARD_FOOTER.size))
+        assert magic == SHARD_MAGIC, "Not a frame shard: {}".format(shard_path)
+        index_size = (self.num_frames + 1) * 8
+        self.offsets = np.frombuffer(self._read(file_size - SHARD_FOOTER.size - index_size, index_size),
+                                     dtype=np.int64)
+
+    def _read(self, offset, length):
+        return positioned_read(self.fd, length, offset, self.lock)
+
+    def read_frame_bytes(self, frame_index):
+        i = frame_index - self.first_frame
+        assert 0 <= i < self.num_frames, \
+            "frame {} not in {} (frames {}-{})".format(frame_index, self.shard_path, self.first_frame,
+                                                      self.first_frame + self.num_frames - 1)
+        return self._read(int(self.offsets[i]), int(self.offsets[i + 1] - self.offsets[i]))
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class FrameShardReader(object):
+    """Drop-in replacement of load_images that reads from the packed shards.
+    Shards are opened lazily in the process that reads them (i.e. in the dataloader workers) and kept open,
+    with at most max_open of them at any time.
+    """
+    def __init__(self, shard_prefix, max_open=64):
+        self.shard_prefix = shard_prefix
+        self.max_open = max_open
+        self.shards = OrderedDict()
+        self.pid = os.getpid()
+
+    def __getstate__(self): # file descriptors are not passed to the worker processes
+        state = self.__dict__.copy()
+        state['shards'] = OrderedDict()
+        return state
+
+    def get_shard(self, data_path):
+        if self.pid != os.getpid(): # forked after opening, get new descriptors for this process
+            self.shards = OrderedDict()
+            self.pid = os.getpid()
+        shard = self.shards.get(data_path)
+        if shard is None:
+            shard = FrameShard(shard_path_from_data_path(data_path, self.shard_prefix))
+            self.shards[data_path] = shard
+            if len(self.shards) > self.max_open:
+                _, oldest = self.shards.popitem(last=False)
+                oldest.close()
+        else:
+            self.shards.move_to_end(data_path)
+        return shard
+
+    def load_images(self, data_path, frame_indices, reduce_factor=1, num_threads=0):
+        shard = self.get_shard(data_path)
+        return map_frames(lambda f_ind: decode_frame(shard.read_frame_bytes(f_ind), reduce_factor),
+                          frame_indices, num_threads)
+
+
+class GulpFrameReader(object):
+    """Reads single frames from the data files of a gulp directory with positioned reads.
+    Every frame of a gulped video is stored at frame_info = [offset, pad, length] of its chunk file, so a clip only
+    needs the byte ranges of its sampled frames instead of the whole video.
+    Chunk files are opened lazily in the reading process and kept open like the shards of FrameShardReader.
+    """
+    def __init__(self, merged_meta_dict, chunk_paths, max_open=16):
+        self.merged_meta_dict = merged_meta_dict
+        self.chunk_paths = chunk_paths # {video id: path of the chunk .gulp file}
+        self.max_open = max_open
+        self.files = OrderedDict()
+        self.pid = os.getpid()
+        self.lock = threading.Lock() # for the reads without pread
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['files'] = OrderedDict()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def get_file(self, chunk_path):
+        if self.pid != os.getpid():
+            self.files = OrderedDict()
+            self.pid = os.getpid()
+        fd = self.files.get(chunk_path)
+        if fd is None:
+            fd = os.open(chunk_path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+            self.files[chunk_path] = fd
+            if len(self.files) > self.max_open:
+                _, oldest = self.files.popitem(last=False)
+                os.close(oldest)
+        else:
+            self.files.move_to_end(chunk_path)
+        return fd
+
+    def read_frame_bytes(self, item_id, frame_index, fd=None):
+        offset, pad, length = self.merged_meta_dict[item_id]['frame_info'][frame_index]
+        if fd is None:
+            fd = self.get_file(self.chunk_paths[item_id])
+        record = positioned_read(fd, length, offset, self.lock)
+        return record[:length - pad]
+
+    def load_images(self, item_id, frame_indices, num_threads=0):
+        # repeated indices (e.g. clips longer than the video) are read and decoded once
+        unique_indices = sorted(set(frame_indices))
+        # the chunk is opened before the decode threads start, they only read from its fd
+        fd = self.get_file(self.chunk_paths[item_id])
+        frames = map_frames(lambda f_ind: decode_frame(self.read_frame_bytes(item_id, f_ind, fd)), unique_indices,
+                            num_threads)
+        frames = dict(zip(unique_indices, frames))
+        return [frames[f_ind] for f_ind in frame_indices]
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Resolution of the sample paths of the split files to files on disk
+
+The split files have windows style sample paths, e.g. 'hand_detection_tracks\\P01\\P01_01\\0_5_69.pkl', and
+the secondary (bpv or object track) pickle of a sample is at the same path with the first directory replaced
+by a prefix, e.g. 'noun_bpv_oh/P01/P01_01/0_5_69.pkl'. SamplePathIndex resolves the primary and secondary
+file of every sample of a split once, with the separators of the running platform. A sample path is also
+accepted as is, if a file with exactly that name exists (e.g. pickles copied from windows with the backslashes
+in their names). The existence checks list every directory once instead of calling os.path.exists per file.
+"""
+
+import os
+
+
+def sample_path_parts(sample_path):
+    # the components of a sample path, with either separator
+    return os.path.normpath(sample_path.replace('\\', '/')).split(os.sep)
+
+
+def native_path(sample_path):
+    return os.sep.join(sample_path_parts(sample_path))
+
+
+def prefixed_path(sample_path, prefix):
+    # the first part of the path is replaced by the prefix
+    return os.path.join(prefix, *sample_path_parts(sample_path)[1:])
+
+
+class SamplePathIndex(object):
+    """data path -> (primary path, secondary path) of every sample in data_paths.
+    secondary_prefix is the directory of the secondary pickles, without it only the primary paths are resolved.
+    The paths that are found nowhere are in missing, as (data path, path) pairs.
+    """
+    def __init__(self, data_paths, secondary_prefix=None):
+        self.secondary_prefix = secondary_prefix
+        self.primary, self.secondary = {}, {}
+        self.missing = []
+        self.listings = {}
+        for data_path in data_paths:
+            if data_path in self.primary:
+                continue
+            candidates = [native_path(data_path), data_path]
+            primary = next((path for path in candidates if self.exists(path)), None)
+            if primary is None:
+                self.missing.append((data_path, candidates[0]))
+                primary = candidates[0]
+            self.primary[data_path] = primary
+            if secondary_prefix:
+                secondary = prefixed_path(data_path, secondary_prefix)
+                if not self.exists(secondary):
+                    self.missing.append((data_path, secondary))
+                self.secondary[data_path] = secondary
+        self.listings = None # only needed while building
+
+    def exists(self, path):
+        dir_name, file_name = os.path.split(path)
+        if dir_name not in self.listings:
+            try:
+                self.listings[dir_name] = set(os.listdir(dir_name or '.'))
+            except OSError: # missing or not a directory
+                self.listings[dir_name] = set()
+        return file_name in self.listings[dir_name]
+
+    def __len__(self):
+        return len(self.primary)
+
+    def check(self, max_shown=5):
+        assert not self.missing, "{} missing pickles, e.g. {}".format(
+            len(self.missing), ", ".join("{} (of {})".format(path, data_path)
+                                         for data_path, path in self.missing[:max_shown]))
+
+    def paths(self, data_path):
+        # the primary path, or the (primary, secondary) pair with a secondary_prefix
+        if self.secondary_prefix:
+            return self.primary[data_path], self.secondary[data_path]
+        return self.primary[data_path]
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Hand track features computed for a whole padded batch
+
+The features of PointDiffDatasetLoader, PointPolarDatasetLoader and AnglesDatasetLoader (distance differences,
+distances from the previous point and angles) only depend on every point and the one before it, so they are
+computed with shifted tensors for all the [B, T, 2] tracks of a batch at once, in O(B*T). The summed vectors of
+PointVectorSummedDatasetLoader are a scatter add of the points of every step and a cumsum over time.
+With batch_features=True the loaders return the raw hand coordinates and TrackFeatureCollate makes the features
+after the padding, e.g. DataLoader(..., collate_fn=TrackFeatureCollate('diffs', norm_val)).
+"""
+
+import numpy as np
+import torch
+
+from utils.dataset_loader_utils import lstm_collate
+
+# number of input features per feature type, i.e. the lstm_input
+TRACK_FEATURE_SIZES = {'diffs': 8, 'polar': 8, 'angles': 2, 'vec_sum': 712, 'vec_sum_dual': 1424}
+
+
+def prev_points(tracks):
+    # the previous point of every step of [..., T, 2] tracks, the first step is its own previous point
+    return torch.cat((tracks[..., :1, :], tracks[..., :-1, :]), -2)
+
+
+def distance_differences(tracks):
+    return tracks - prev_points(tracks)
+
+
+def polar_distances(tracks):
+    # euclidean distance of every point from the previous one, 0 for the first
+    return distance_differences(tracks).norm(dim=-1)
+
+
+def angles(tracks):
+    # signed angle between the position vectors of every point and the previous one, 0 for the first
+    prev = prev_points(tracks)
+    cross = tracks[..., 1] * prev[..., 0] - prev[..., 1] * tracks[..., 0]
+    dot = tracks[..., 0] * prev[..., 0] + tracks[..., 1] * prev[..., 1]
+    return torch.atan2(cross, dot)
+
+
+def make_track_features(coords, seq_lengths, feature, norm_val):
+    """Returns the [B, T, TRACK_FEATURE_SIZES[feature]] features of the [B, T, 4] padded raw (left x, left y,
+    right x, right y) coords, in the same order as the loaders make them per sample and zero after seq_lengths"""
+    norm_val = torch.tensor(norm_val, dtype=coords.dtype)
+    left, right = coords[..., :2], coords[..., 2:4]
+    left_norm, right_norm = left / norm_val[:2], right / norm_val[2:4]
+    if feature == 'diffs':
+        features = [left_norm, distance_differences(left_norm), right_norm, distance_differences(right_norm)]
+    elif feature == 'polar': # the angles are calculated before normalizing the tracks
+        features = [left_norm, polar_distances(left_norm).unsqueeze(-1), angles(left).unsqueeze(-1),
+                    right_norm, polar_distances(right_norm).unsqueeze(-1), angles(right).unsqueeze(-1)]
+    elif feature == 'angles':
+        features = [angles(left).unsqueeze(-1), angles(right).unsqueeze(-1)]
+    else:
+        raise ValueError("Unknown track feature {}".format(feature))
+    features = torch.cat(features, -1)
+    mask = torch.arange(features.size(1)).unsqueeze(0) < torch.as_tensor(seq_lengths).unsqueeze(1)
+    return features * mask.unsqueeze(-1).to(features.dtype)
+
+
+def make_vec_sum_features(coords, seq_lengths, dual=False, max_seq_length=0):
+    """Returns the [B, T or max_seq_length, 712 (1424 with dual)] summed vectors of the [B, T, 4] padded raw coords,
+    the same as calc_vec_sum and the linspace subsampling of PointVectorSummedDatasetLoader, and their lengths"""
+    batch_size, seq_size = coords.size(0), coords.size(1)
+    seq_lengths = torch.as_tensor(seq_lengths)
+    feat_size = 456 + 256
+    coords = coords.long()
+    valid_steps = torch.arange(seq_size).unsqueeze(0) < seq_lengths.unsqueeze(1)
+    vec = torch.zeros(batch_size, seq_size, feat_size * 2 if dual else feat_size)
+    batch_index = torch.arange(batch_size).unsqueeze(1).expand(batch_size, seq_size)
+    step_index = torch.arange(seq_size).unsqueeze(0).expand(batch_size, seq_size)
+    for hand, addon in ((coords[..., :2], 0), (coords[..., 2:4], feat_size if dual else 0)):
+        valid = valid_steps & (hand[..., 1] < 256)
+        b, t, x, y = batch_index[valid], step_index[valid], hand[..., 0][valid], hand[..., 1][valid]
+        ones = torch.ones(len(b))
+        vec.index_put_((b, t, (addon + x) % vec.size(2)), ones, accumulate=True) # % for the negative indices of numpy
+        vec.index_put_((b, t, (addon + 456 + y) % vec.size(2)), ones, accumulate=True)
+    vec = vec.cumsum(1)
+    if max_seq_length == 0:
+        return vec * valid_steps.unsqueeze(-1).to(vec.dtype), seq_lengths
+    rows = torch.stack([torch.from_numpy(np.linspace(0, length, max_seq_length, endpoint=False, dtype=int))
+                        for length in seq_lengths.tolist()])
+    vec = vec[torch.arange(batch_size).unsqueeze(1), rows]
+    return vec, torch.full_like(seq_lengths, max_seq_length)
+
+
+class TrackFeatureCollate(object):
+    """Collate hook that pads the raw coords of the loaders (with collate_fn) and replaces them
+    with their batch features. max_seq_length is only for the vec_sum features, which are subsampled after
+    the cumsum over the full tracks"""
+    def __init__(self, feature, norm_val=None, collate_fn=lstm_collate, max_seq_length=0):
+        assert feature in TRACK_FEATURE_SIZES, "Unknown track feature {}".format(feature)
+        self.feature = feature
+        self.norm_val = norm_val if norm_val is not None else [1., 1., 1., 1.]
+        self.collate_fn = collate_fn
+        self.max_seq_length = max_seq_length
+
+    def __call__(self, batch):
+        collated = self.collate_fn(batch)
+        if self.feature.startswith('vec_sum'):
+            collated[0], collated[1] = make_vec_sum_features(collated[0], collated[1], self.feature == 'vec_sum_dual',
+                                                             self.max_seq_length)
+        else:
+            collated[0] = make_track_features(collated[0], collated[1], self.feature, self.norm_val)
+        return collated
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Trail images of hand tracks
+
+The trail image of step i of a track has the points 0..i of both hands drawn with intensity j/i for the point
+of step j, i.e. the newest point is 1 and the older ones fade linearly. Between two steps every intensity only
+decays by (i-1)/i and the new points are drawn with 1, so instead of redrawing the whole history for every
+step the rasterizer keeps one image with the last step that visited each pixel (an O(1) update per step)
+and renders from it only the frames that are returned.
+"""
+
+import numpy as np
+
+
+class TrailRasterizer(object):
+    """Renders the [height/scale, width/scale, num_frames] trail images of a pair of hand tracks.
+    Only the trail images of the last max_frames steps are returned (all with max_frames=0), further
+    limited to what fits in max_mb MB of float32 if max_mb > 0. Points outside of height x width are skipped.
+    """
+    def __init__(self, height=256, width=456, scale=1, max_frames=0, max_mb=0):
+        self.height, self.width = height // scale, width // scale
+        self.scale = scale
+        self.max_frames = max_frames
+        if max_mb > 0:
+            frames_in_mb = max(1, int(max_mb * 2**20 // (self.height * self.width * 4)))
+            self.max_frames = min(self.max_frames, frames_in_mb) if self.max_frames > 0 else frames_in_mb
+
+    def pixels(self, track):
+        # flat pixel index of every step of a [T, 2] (x, y) track, -1 where the point is out of the image
+        xs, ys = track[:, 0] // self.scale, track[:, 1] // self.scale
+        valid = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+        return np.where(valid, ys * self.width + xs, -1)
+
+    def __call__(self, left_track, right_track):
+        seq_size = len(left_track)
+        num_frames = min(seq_size, self.max_frames) if self.max_frames > 0 else seq_size
+        first_frame = seq_size - num_frames
+        left_pixels = self.pixels(np.asarray(left_track, dtype=np.int64))
+        right_pixels = self.pixels(np.asarray(right_track, dtype=np.int64))
+
+        last_step = np.full(self.height * self.width, -1, dtype=np.int64)
+        visited = np.zeros(2 * seq_size, dtype=np.int64) # the pixels drawn so far
+        num_visited = 0
+        point_imgs = np.zeros([self.height, self.width, num_frames], dtype=np.float32)
+        for i in range(seq_size):
+            for pixel in (left_pixels[i], right_pixels[i]):
+                if pixel >= 0:
+                    if last_step[pixel] < 0:
+                        visited[num_visited] = pixel
+                        num_visited += 1
+                    last_step[pixel] = i
+            if i < first_frame:
+                continue
+            pixels = visited[:num_visited]
+            intensities = last_step[pixels] / i if i > 0 else np.ones(num_visited)
+            frame = point_imgs[:, :, i - first_frame]
+            frame[pixels // self.width, pixels % self.width] = intensities
+        return point_imgs
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar store of the hand tracks of a dataset
+
+All the hand track pickles of one or more split files are packed into a few flat arrays with a
+per-sample offset index, instead of one pickle per segment:
+
+    tracks.npy   float32 [total_steps, 4], (left x, left y, right x, right y) of every step of every sample
+    bpv_ids.npy  int32 [total_objects], the object ids of every step (optional, from the bpv pickles)
+    objects.npy  float32 [total_object_steps, 704], the object tracks (optional, from the object pickles)
+    index.npz    the data paths of the samples and the offsets of each sample (and each step for bpv_ids)
+
+The arrays are memory mapped, so opening a store does not read the tracks and the dataloader workers
+share the pages of the same files. load_point_samples also packs the pickles it loads into an in memory store,
+the few numpy buffers are not copied into the forked workers the way a list of dicts of lists is.
+"""
+
+import os
+import tempfile
+
+import numpy as np
+
+from utils.feature_cache import remove_quietly
+
+TRACKS_FILE = 'tracks.npy'
+BPV_IDS_FILE = 'bpv_ids.npy'
+OBJECTS_FILE = 'objects.npy'
+INDEX_FILE = 'index.npz'
+
+
+def pack_hand_tracks(data_paths, samples, secondary=None):
+    """Returns the arrays of the store as a dict.
+    samples yields for every data path the hand tracks dict of its pickle, or a (hand tracks, bpv) or
+    (hand tracks, object tracks) tuple with secondary 'bpv' or 'objects' (see load_point_samples).
+    """
+    assert secondary in [None, 'bpv', 'objects']
+    track_lengths = np.zeros(len(data_paths), dtype=np.int64)
+    object_lengths = np.zeros(len(data_paths), dtype=np.int64)
+    tracks, bpv_ids, bpv_lengths, objects = [], [], [], []
+    for i, (data_path, sample) in enumerate(zip(data_paths, samples)):
+        hand_tracks = sample[0] if secondary else sample
+        left_track = np.array(hand_tracks['left'], dtype=np.float32).reshape(-1, 2)
+        right_track = np.array(hand_tracks['right'], dtype=np.float32).reshape(-1, 2)
+        assert len(left_track) == len(right_track), "Left and right tracks of {} differ in length".format(data_path)
+        tracks.append(np.concatenate((left_track, right_track), axis=1))
+        track_lengths[i] = len(left_track)
+        if secondary == 'bpv':
+            detections = sample[1]
+            assert len(detections) == len(left_track), "bpv of {} does not match its track length".format(data_path)
+            bpv_lengths.extend(len(dets) for dets in detections)
+            bpv_ids.extend(obj for dets in detections for obj in dets)
+        elif secondary == 'objects':
+            object_tracks = np.asarray(sample[1], dtype=np.float32)
+            objects.append(object_tracks)
+            object_lengths[i] = len(object_tracks)
+
+    arrays = {'data_paths': np.array(data_paths),
+              'track_offsets': np.concatenate(([0], np.cumsum(track_lengths))),
+              'tracks': np.concatenate(tracks) if tracks else np.zeros((0, 4), dtype=np.float32)}
+    if secondary == 'bpv':
+        arrays['bpv_offsets'] = np.concatenate(([0], np.cumsum(bpv_lengths))).astype(np.int64)
+        arrays['bpv_ids'] = np.array(bpv_ids, dtype=np.int32)
+    elif secondary == 'objects':
+        arrays['object_offsets'] = np.concatenate(([0], np.cumsum(object_lengths)))
+        arrays['objects'] = np.concatenate(objects)
+    return arrays
+
+
+def save_track_store(store_dir, arrays):
+    os.makedirs(store_dir, exist_ok=True)
+    np.save(os.path.join(store_dir, TRACKS_FILE), arrays['tracks'])
+    if 'bpv_ids' in arrays:
+        np.save(os.path.join(store_dir, BPV_IDS_FILE), arrays['bpv_ids'])
+    if 'objects' in arrays:
+        np.save(os.path.join(store_dir, OBJECTS_FILE), arrays['objects'])
+    index = {k: v for k, v in arrays.items() if k not in ['tracks', 'bpv_ids', 'objects']}
+    np.savez(os.path.join(store_dir, INDEX_FILE), **index)
+
+
+class TrackStore(object):
+    """Hand tracks (and optionally the bpv object ids or the object tracks) of many samples in flat arrays.
+    get_tracks(get_index(data_path)) returns the same {'left': ..., 'right': ...} structure as the pickle of
+    data_path, with read only views into the arrays instead of lists.
+    """
+    def __init__(self, arrays):
+        self.data_paths = [str(p) for p in arrays['data_paths']]
+        self.track_offsets = arrays['track_offsets']
+        self.tracks = arrays['tracks']
+        self.bpv_offsets = arrays.get('bpv_offsets')
+        self.bpv_ids = arrays.get('bpv_ids')
+        self.object_offsets = arrays.get('object_offsets')
+        self.objects = arrays.get('objects')
+        self.sample_index = {data_path: i for i, data_path in enumerate(self.data_paths)}
+        # what was packed next to the hand tracks
+        self.secondary = 'bpv' if self.bpv_ids is not None else 'objects' if self.objects is not None else None
+
+    @classmethod
+    def open(cls, store_dir):
+        """Memory maps a store written with save_track_store"""
+        with np.load(os.path.join(store_dir, INDEX_FILE)) as index:
+            arrays = {k: index[k] for k in index.files}
+        arrays['tracks'] = np.load(os.path.join(store_dir, TRACKS_FILE), mmap_mode='r')
+        if os.path.exists(os.path.join(store_dir, BPV_IDS_FILE)):
+            arrays['bpv_ids'] = np.load(os.path.join(store_dir, BPV_IDS_FILE), mmap_mode='r')
+        if os.path.exists(os.path.join(store_dir, OBJECTS_FILE)):
+            arrays['objects'] = np.load(os.path.join(store_dir, OBJECTS_FILE), mmap_mode='r')
+        return cls(arrays)
+
+    def __len__(self):
+        return len(self.data_paths)
+
+    def __contains__(self, data_path):
+        return data_path in self.sample_index
+
+    def get_index(self, data_path):
+        assert data_path in self.sample_index, "{} is not in the track store".format(data_path)
+        return self.sample_index[data_path]
+
+    def get_tracks(self, i):
+        track = self.tracks[self.track_offsets[i]:self.track_offsets[i + 1]]
+        return {'left': track[:, :2], 'right': track[:, 2:]}
+
+    def get_bpv(self, i):
+        # list with the object ids of every step, as in the bpv pickles
+        assert self.bpv_ids is not None, "The track store has no bpv"
+        step_offsets = self.bpv_offsets[self.track_offsets[i]:self.track_offsets[i + 1] + 1]
+        return [self.bpv_ids[s:e].tolist() for s, e in zip(step_offsets[:-1], step_offsets[1:])]
+
+    def max_objects_per_step(self):
+        # with the repeated detections of a step, an upper bound of the unique ids of object_list_to_ids
+        assert self.bpv_ids is not None, "The track store has no bpv"
+        return int(np.diff(self.bpv_offsets).max()) if len(self.bpv_offsets) > 1 else 0
+
+    def get_objects(self, i):
+        assert self.objects is not None, "The track store has no object tracks"
+        return self.objects[self.object_offsets[i]:self.object_offsets[i + 1]]
+
+    def samples(self, samples_list, with_secondary=False):
+        """Returns the sequence of the samples of samples_list in the format of load_point_samples,
+        i.e. tracks dicts, or (tracks, bpv) / (tracks, objects) tuples with_secondary"""
+        if with_secondary:
+            assert self.secondary is not None, "The track store has only the hand tracks"
+        return TrackStoreSamples(self, [self.get_index(s.data_path) for s in samples_list],
+                                 self.secondary if with_secondary else None)
+
+
+def compact_objects_offsets_path(cache_path):
+    # the offsets of the samples in the cached objects, next to them
+    return os.path.splitext(cache_path)[0] + '_offsets.npy'
+
+
+def load_compact_objects(cache_path):
+    """Returns the memory mapped objects and the offsets that compact_objects cached at cache_path,
+    or None if they are not there. Nothing else is needed, so a cache hit does not load the object pickles."""
+    offsets_path = compact_objects_offsets_path(cache_path)
+    if not (os.path.exists(cache_path) and os.path.exists(offsets_path)):
+        return None
+    return np.load(cache_path, mmap_mode='r'), np.load(offsets_path)
+
+
+def save_array(path, array):
+    # a unique temp name, parallel runs that build the same cache do not write into the same file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.npy')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+    except BaseException:
+        remove_quietly(tmp_path)
+        raise
+
+
+def compact_objects(samples, norm_val, cache_path=None):
+    """Returns the object tracks of the TrackStoreSamples samples, divided once by the (x, y) norm_val and
+    stored as float16 in one array in the order of the samples, and the offsets of each sample in it.
+    With a cache_path the array and the offsets are written there and memory mapped (see load_compact_objects
+    for the next runs).
+    """
+    store = samples.store
+    assert store.objects is not None, \
+        "compact_objects needs a track store of the object tracks, not of the {}".format(store.secondary or 'hand tracks only')
+    starts, ends = store.object_offsets[samples.indices], store.object_offsets[samples.indices + 1]
+    offsets = np.concatenate(([0], np.cumsum(ends - starts)))
+    if cache_path is not None:
+        cached = load_compact_objects(cache_path)
+        if cached is not None:
+            return cached
+
+    shape = (int(offsets[-1]), store.objects.shape[1])
+    if cache_path is not None:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix='.npy')
+        os.close(fd)
+        try:
+            objects = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float16, shape=shape)
+            normalize_objects(store, starts, ends, offsets, norm_val, objects)
+            objects.flush()
+            del objects
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            remove_quietly(tmp_path)
+            raise
+        save_array(compact_objects_offsets_path(cache_path), offsets)
+        return np.load(cache_path, mmap_mode='r'), offsets
+    objects = np.empty(shape, dtype=np.float16)
+    normalize_objects(store, starts, ends, offsets, norm_val, objects)
+    return objects, offsets
+
+
+def normalize_objects(store, starts, ends, offsets, norm_val, objects):
+    norm = np.tile(np.asarray(norm_val[:2], dtype=np.float32), objects.shape[1] // 2)
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        objects[offsets[i]:offsets[i + 1]] = store.objects[start:end] / norm
+
+
+class TrackStoreSamples(object):
+    def __init__(self, store, indices, secondary=None):
+        assert secondary in [None, 'bpv', 'objects']
+        self.store = store
+        self.indices = np.array(indices, dtype=np.int64)
+        self.secondary = secondary
+
+    def __len__(self):
+        return len(self.indices)
+
+    def lengths(self):
+        # number of track steps of every sample
+        return np.diff(self.store.track_offsets)[self.indices]
+
+    def __getitem__(self, index):
+        i = self.indices[index]
+        tracks = self.store.get_tracks(i)
+        if self.secondary == 'bpv':
+            return tracks, self.store.get_bpv(i)
+        if self.secondary == 'objects':
+            return tracks, self.store.get_objects(i)
+        return tracks
@@ -20,6 +20,7 @@ from torch.optim.lr_scheduler import _LRScheduler
 
 from utils.calc_utils import AverageMeter, accuracy
 from utils.file_utils import print_and_save
+from utils.dataset_loader_utils import lstm_inputs_to_gpu
 
 class CustomLRScheduler(object):
     def __init__(self, optimizer, last_epoch=-1):
@@ -397,8 +398,7 @@ def train_lstm_do(model, optimizer, criterion, train_iterator, cur_epoch, log_fi
         if isinstance(lr_scheduler, CyclicLR):
             lr_scheduler.step()
             
-        inputs = torch.tensor(inputs, requires_grad=True).cuda()
-        inputs = inputs.transpose(1, 0)
+        inputs = lstm_inputs_to_gpu(inputs, requires_grad=True)
         output_a, output_b = model(inputs, seq_lengths)
         
         targets_a = torch.tensor(targets[0]).cuda()
@@ -440,8 +440,7 @@ def test_lstm_do(model, criterion, test_iterator, cur_epoch, dataset, log_file):
         model.eval()
         print_and_save('Evaluating after epoch: {} on {} set'.format(cur_epoch, dataset), log_file)
         for batch_idx, (inputs, seq_lengths, targets) in enumerate(test_iterator):
-            inputs = torch.tensor(inputs).cuda()
-            inputs = inputs.transpose(1, 0)
+            inputs = lstm_inputs_to_gpu(inputs)
 
             output_a, output_b = model(inputs, seq_lengths)
             
@@ -492,10 +491,9 @@ def train_lstm(model, optimizer, criterion, train_iterator, cur_epoch, log_file,
 #        inputs.transpose_(1,2)
 #        inputs.transpose_(0,1)
         
-        inputs = torch.tensor(inputs, requires_grad=True).cuda()
+        inputs = lstm_inputs_to_gpu(inputs, requires_grad=True)
         targets = torch.tensor(targets).cuda()
 
-        inputs = inputs.transpose(1, 0)
         output = model(inputs, seq_lengths)
 
         loss = criterion(output, targets)
@@ -520,10 +518,9 @@ def test_lstm(model, criterion, test_iterator, cur_epoch, dataset, log_file):
         model.eval()
         print_and_save('Evaluating after epoch: {} on {} set'.format(cur_epoch, dataset), log_file)
         for batch_idx, (inputs, seq_lengths, targets) in enumerate(test_iterator):
-            inputs = torch.tensor(inputs).cuda()
+            inputs = lstm_inputs_to_gpu(inputs)
             targets = torch.tensor(targets).cuda()
 
-            inputs = inputs.transpose(1, 0)
             output = model(inputs, seq_lengths)
             
             loss = criterion(output, targets)
@@ -32,11 +32,19 @@ class MiddleSampling(object):
             middle = start_frame + range_max//2
             clip_start = middle - 16
             clip_end = middle + 16
-        idxs = np.linspace(clip_start, clip_end, self.num).astype(dtype=np.int).tolist()
+        idxs = np.linspace(clip_start, clip_end, self.num).astype(dtype=int).tolist()
         for idx in idxs:
             assert idx >=start_frame and idx < start_frame+range_max
         return idxs
 
+    def plan(self, range_maxes, start_frames, seed, epoch):
+        # the same clips as sampling for all the segments, there is nothing random to draw
+        assert np.all(range_maxes > 0)
+        middle = start_frames + range_maxes // 2
+        clip_start = np.where(range_maxes <= 32, start_frames, middle - 16)
+        clip_end = np.where(range_maxes <= 32, start_frames + range_maxes - 1, middle + 16)
+        return (clip_start[:, np.newaxis] + (clip_end - clip_start)[:, np.newaxis] * np.linspace(0, 1, self.num)).astype(int)
+
 class RandomSampling(object):
     def __init__(self, num, interval=1, speed=[1.0, 1.0], seed=0):
         assert num > 0, "at least sampling 1 frame"
@@ -60,11 +68,31 @@ class RandomSampling(object):
         frame_range = (self.num-1) * random_interval
         clip_start = self.rng.uniform(0, (range_max-1) - frame_range) + start_frame
         clip_end = clip_start + frame_range
-        idxs = np.linspace(clip_start, clip_end, self.num).astype(dtype=np.int).tolist()
+        idxs = np.linspace(clip_start, clip_end, self.num).astype(dtype=int).tolist()
         for idx in idxs:
             assert idx >=start_frame and idx <= start_frame+range_max
         return idxs
 
+    def plan(self, range_maxes, start_frames, seed, epoch):
+        """[num_segments, num] frame indices of one clip per segment, drawn as in sampling for all the segments at once"""
+        rng = np.random.RandomState([seed, epoch])
+        num_segments = len(range_maxes)
+        assert np.all(range_maxes > 0)
+        random_frames = start_frames + (rng.rand(num_segments) * range_maxes).astype(int)
+        if self.num == 1:
+            return random_frames[:, np.newaxis]
+        interval = rng.choice(self.interval, num_segments)
+        speed_min = self.speed[0]
+        speed_max = np.minimum(self.speed[1], (range_maxes - 1) / ((self.num - 1) * interval))
+        random_interval = rng.uniform(speed_min, np.maximum(speed_max, speed_min)) * interval
+        frame_range = (self.num - 1) * random_interval
+        clip_start = rng.uniform(0, np.maximum((range_maxes - 1) - frame_range, 0)) + start_frames
+        idxs = (clip_start[:, np.newaxis] + frame_range[:, np.newaxis] * np.linspace(0, 1, self.num)).astype(int)
+        # segments too short for the slowest speed repeat a random frame, as in sampling
+        too_short = speed_max < speed_min
+        idxs[too_short] = random_frames[too_short, np.newaxis]
+        return idxs
+
 
 class SequentialSampling(object):
     def __init__(self, num, interval=1, shuffle=False, fix_cursor=False, seed=0):
@@ -102,6 +130,85 @@ class SequentialSampling(object):
             assert idx >=start_frame and idx <= start_frame+range_max
         return idxs
 
+    def plan(self, range_maxes, start_frames, seed, epoch):
+        """[num_segments, num] frame indices of one clip per segment for all the segments at once.
+        The clip of a segment is the same in every epoch with fix_cursor, otherwise the next clip of the
+        segment every epoch. With shuffle the first clip is random, instead of a shuffled order the clips
+        are then visited from there on"""
+        rng = np.random.RandomState([seed]) # the same for every epoch
+        num_segments = len(range_maxes)
+        assert np.all(range_maxes > 0)
+        interval = rng.choice(self.interval, num_segments)
+        frame_range = (self.num - 1) * interval + 1
+        num_clips = np.maximum(0, -(-(range_maxes - (frame_range - 1)) // frame_range))
+        first_clip = (rng.rand(num_segments) * num_clips).astype(int) if self.shuffle else np.zeros(num_segments, dtype=int)
+        random_frames = start_frames + (rng.rand(num_segments) * range_maxes).astype(int)
+        cursor = first_clip if self.fix_cursor else (first_clip + epoch) % np.maximum(num_clips, 1)
+        clip_start = start_frames + cursor * frame_range
+        idxs = clip_start[:, np.newaxis] + interval[:, np.newaxis] * np.arange(self.num)
+        # segments without a whole clip repeat a random frame, as in sampling
+        idxs[num_clips == 0] = random_frames[num_clips == 0, np.newaxis]
+        return idxs
+
+
+class EpochClipPlanner(object):
+    """Draws the clips of all the segments of a dataset for one epoch at once with the plan method of the sampler
+    (RandomSampling or SequentialSampling) and is used in its place, sampling returns the planned clip of v_id
+    (the index of the segment in the dataset). The plan depends only on the seed and the epoch: set_epoch is called
+    in the main process before the dataloader workers are started and every worker reads the same rows, instead
+    of drawing from a RandomState that is copied to all the workers and repeats the same draws in each of them.
+    """
+    def __init__(self, sampler, range_maxes, start_frames, seed=0):
+        assert hasattr(sampler, 'plan'), "{} does not support clip planning".format(type(sampler).__name__)
+        self.sampler = sampler
+        self.range_maxes = np.asarray(range_maxes, dtype=np.int64)
+        self.start_frames = np.asarray(start_frames, dtype=np.int64)
+        self.seed = seed
+        self.epoch = None
+        self.clips = None
+        self.set_epoch(0)
+
+    def set_epoch(self, epoch):
+        if epoch != self.epoch:
+            self.clips = self.sampler.plan(self.range_maxes, self.start_frames, self.seed, epoch)
+            self.epoch = epoch
+
+    def sampling(self, range_max, v_id, prev_failed=False, start_frame=0):
+        assert range_max == self.range_maxes[v_id] and start_frame == self.start_frames[v_id], \
+            "segment {} is not the planned one".format(v_id)
+        return self.clips[v_id].tolist()
+
+
+class DenseClipIndex(object):
+    """All the (segment, clip) windows of a dataset as a flat index, for evaluating every clip of every segment
+    in one pass. The clips of a segment are the SequentialSampling clips (num frames every interval frames),
+    with a new clip every stride frames (the clip length by default, i.e. not overlapping). A segment shorter
+    than one clip has a single clip of num frames spread evenly over the segment.
+    segment_ids[i] and clips[i] are the segment and the frame indices of window i, the windows of segment s
+    are segment_offsets[s]:segment_offsets[s + 1].
+    """
+    def __init__(self, range_maxes, start_frames, num, interval=1, stride=None):
+        range_maxes = np.asarray(range_maxes, dtype=np.int64)
+        start_frames = np.asarray(start_frames, dtype=np.int64)
+        assert np.all(range_maxes > 0)
+        frame_range = (num - 1) * interval + 1
+        stride = stride or frame_range
+        num_clips = np.maximum(1, -(-(range_maxes - (frame_range - 1)) // stride))
+        self.segment_offsets = np.concatenate(([0], np.cumsum(num_clips)))
+        self.segment_ids = np.repeat(np.arange(len(range_maxes)), num_clips)
+        clip_in_segment = np.arange(len(self.segment_ids)) - self.segment_offsets[self.segment_ids]
+        clip_starts = start_frames[self.segment_ids] + clip_in_segment * stride
+        self.clips = clip_starts[:, np.newaxis] + interval * np.arange(num)
+        short = range_maxes < frame_range
+        spread = start_frames[short, np.newaxis] + (range_maxes[short, np.newaxis] * np.arange(num)) // num
+        self.clips[self.segment_offsets[:-1][short]] = spread
+
+    def __len__(self):
+        return len(self.segment_ids)
+
+    def num_segments(self):
+        return len(self.segment_offsets) - 1
+
 
 if __name__ == "__main__":
 